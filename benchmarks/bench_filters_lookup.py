@@ -0,0 +1,85 @@
+"""
+Сравнение получения фильтров всех подписчиков репозитория:
+SMEMBERS + HGET на каждый чат (как было) против get_filters_for_repo (SMEMBERS + pipeline).
+
+Нужен локальный Redis (настройки из Config). Создаются и затем удаляются
+подписки только для тестового репозитория.
+
+Запуск: PYTHONPATH=src python benchmarks/bench_filters_lookup.py --chats 10 100 500
+
+Пример (Redis 6.2 на localhost, 1 vCPU, медиана 50 прогонов):
+ chats   per-chat, ms    bulk, ms   speedup
+    10          0.749       0.490      1.5x
+   100          7.858       3.386      2.3x
+   500         43.098      11.729      3.7x
+"""
+
+import argparse
+import statistics
+import time
+
+import payloads
+from redis_storage import storage
+
+BENCH_REPO_URL = payloads.REPO_URL + "-filters-bench"
+BENCH_CHAT_BASE = -1009100000000
+
+
+def per_chat_lookup(repo_url: str) -> dict:
+    """
+    Как раньше: отдельный HGET на каждый чат
+    """
+
+    return {chat_id: storage.get_filters(chat_id, repo_url) for chat_id in storage.get_chats_for_repo(repo_url)}
+
+
+def bulk_lookup(repo_url: str) -> dict:
+    """
+    Сейчас: один конвейер на все чаты
+    """
+
+    return storage.get_filters_for_repo(repo_url)
+
+
+def measure(func, rounds: int) -> float:
+    """
+    Медиана времени вызова в миллисекундах
+    """
+
+    func(BENCH_REPO_URL)
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(BENCH_REPO_URL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk filter lookup benchmark")
+    parser.add_argument("--chats", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'chats':>6}{'per-chat, ms':>15}{'bulk, ms':>12}{'speedup':>10}")
+    created = []
+    try:
+        for chats in args.chats:
+            while len(created) < chats:
+                chat_id = BENCH_CHAT_BASE - len(created)
+                storage.add_subscription(chat_id, BENCH_REPO_URL)
+                storage.add_repo_chat_mapping(BENCH_REPO_URL, chat_id)
+                created.append(chat_id)
+
+            assert per_chat_lookup(BENCH_REPO_URL) == bulk_lookup(BENCH_REPO_URL)
+            before = measure(per_chat_lookup, args.rounds)
+            after = measure(bulk_lookup, args.rounds)
+            print(f"{chats:>6}{before:>15.3f}{after:>12.3f}{before / after:>9.1f}x")
+    finally:
+        for chat_id in created:
+            storage.remove_subscription(chat_id, BENCH_REPO_URL)
+            storage.remove_repo_chat_mapping(BENCH_REPO_URL, chat_id)
+
+
+if __name__ == "__main__":
+    main()
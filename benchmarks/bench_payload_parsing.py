@@ -0,0 +1,66 @@
+"""
+Сравнение разбора тела вебхука: двойное чтение + json (как было) против
+однократного разбора байтов (payload.loads, orjson если установлен).
+
+Запуск: python benchmarks/bench_payload_parsing.py
+"""
+
+import json
+import time
+
+import payloads
+from payload import loads, extract_event_info, orjson
+
+
+def legacy_parse(body: bytes) -> dict:
+    """
+    Как раньше: request.read() + request.json() (decode + json.loads)
+    """
+
+    payload_bytes = bytes(body)  # копия буфера, как при повторном чтении
+    payload = json.loads(payload_bytes.decode("utf-8"))
+    payload.get("repository", {}).get("full_name")
+    return payload
+
+
+def single_pass_parse(body: bytes) -> dict:
+    """
+    Сейчас: один разбор байтов и извлечение полей маршрутизации
+    """
+
+    payload = loads(body)
+    extract_event_info(payload)
+    return payload
+
+
+def measure(func, body: bytes, rounds: int) -> float:
+    """
+    Среднее время одного вызова в миллисекундах
+    """
+
+    func(body)  # прогрев
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(body)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    cases = {
+        "push (1000 commits)": payloads.push_payload(commits=1000),
+        "push (20 commits)": payloads.push_payload(commits=20),
+        "pull_request (20 KB body)": payloads.pull_request_payload(body_length=20000),
+    }
+
+    print(f"decoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+    print(f"{'payload':<28}{'size':>10}{'before, ms':>13}{'after, ms':>12}{'speedup':>10}")
+    for name, payload in cases.items():
+        body = json.dumps(payload).encode()
+        rounds = 50 if len(body) > 200_000 else 500
+        before = measure(legacy_parse, body, rounds)
+        after = measure(single_pass_parse, body, rounds)
+        print(f"{name:<28}{len(body) // 1024:>8}KB{before:>13.3f}{after:>12.3f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Бенчмарк конвейера вебхуков: подписанные синтетические payload'ы прогоняются через
+webhook_server.create_app с помощью тестового клиента aiohttp.
+
+Для каждого сценария выводятся запросы в секунду, задержка p50/p99 и объём памяти,
+выделяемой на запрос (пик tracemalloc). Результаты можно сохранить как baseline и
+сравнивать с ним последующие прогоны.
+
+Примеры (модули бота импортируются из src/):
+    PYTHONPATH=src python benchmarks/bench_webhook.py --fakeredis
+    PYTHONPATH=src python benchmarks/bench_webhook.py --save-baseline benchmarks/baseline.json
+    PYTHONPATH=src python benchmarks/bench_webhook.py --compare benchmarks/baseline.json
+
+По умолчанию используется Redis из Config (REDIS_HOST/REDIS_PORT/REDIS_DB): создаются
+подписки только для тестового репозитория и удаляются после прогона.
+Лимиты Telegram по умолчанию отключены (--telegram-limits - оставить). Ответ на вебхук
+не ждёт отправок, но тестовые чаты - группы (20 сообщений в минуту), и на длинном прогоне
+их очереди доходят до DELIVERY_PARTITION_QUEUE_SIZE, после чего постановка ждёт места.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+import payloads
+from config import Config
+from delivery import DeliveryResult, SENT, dispatcher
+from redis_storage import storage
+
+BENCH_CHAT_BASE = -1009000000000
+
+
+def build_scenarios() -> dict:
+    """
+    Сценарии: имя -> (список (event_type, payload), параллельность)
+    """
+
+    return {
+        "push_small": ([("push", payloads.push_payload(commits=3))], 1),
+        "push_1000_commits": ([("push", payloads.push_payload(commits=1000))], 1),
+        "pull_request_long_body": ([("pull_request", payloads.pull_request_payload(body_length=20000))], 1),
+        "issues": ([("issues", payloads.issues_payload())], 1),
+        "issue_comment": ([("issue_comment", payloads.issue_comment_payload())], 1),
+        "pr_review_comment": ([("pull_request_review_comment", payloads.pr_review_comment_payload())], 1),
+        "create": ([("create", payloads.create_payload())], 1),
+        "workflow_run_burst": ([
+            ("workflow_run", payloads.workflow_run_payload(action, run_id=run_id))
+            for run_id in range(1, 21)
+            for action in ("requested", "in_progress", "completed")
+        ], 20),
+    }
+
+
+def sign(body: bytes) -> str:
+    """
+    Подпись X-Hub-Signature-256
+    """
+
+    return "sha256=" + hmac.new(Config.WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+class StubNotifier:
+    """
+    Заглушка отправки в Telegram: только считает вызовы
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, chat_id: int, text: str, event_key: str = None,
+                       edit_existing: bool = False, **kwargs) -> DeliveryResult:
+        self.calls += 1
+        return DeliveryResult(SENT, self.calls)
+
+
+def setup_storage(use_fakeredis: bool, chats: int) -> list:
+    """
+    Подготовка Redis: подписки тестовых чатов на тестовый репозиторий
+    """
+
+    if use_fakeredis:
+        import fakeredis
+        storage.client = fakeredis.FakeRedis(decode_responses=True)
+
+    chat_ids = [BENCH_CHAT_BASE - i for i in range(chats)]
+    for chat_id in chat_ids:
+        storage.add_subscription(chat_id, payloads.REPO_URL)
+        storage.add_repo_chat_mapping(payloads.REPO_URL, chat_id)
+
+    # коммиты PR берутся из кэша, чтобы не ходить в GitHub API
+    pr = payloads.pull_request_payload()["pull_request"]
+    storage.cache_pr_commits(payloads.REPO_FULL_NAME, pr["number"], pr["head"]["sha"],
+                             [{"sha": "0" * 40, "message": "Synthetic commit",
+                               "author": {"name": "Dev"}, "html_url": ""}] * 10,
+                             ttl=3600)
+    return chat_ids
+
+
+def cleanup_storage(chat_ids: list):
+    """
+    Удаление данных, созданных бенчмарком
+    """
+
+    for chat_id in chat_ids:
+        storage.remove_subscription(chat_id, payloads.REPO_URL)
+        storage.remove_repo_chat_mapping(payloads.REPO_URL, chat_id)
+    for pattern in (f"event_messages:*{payloads.REPO_FULL_NAME}*",
+                    f"event_updates:*{payloads.REPO_FULL_NAME}*",
+                    "send_rate:*"):
+        for key in storage.client.scan_iter(pattern):
+            storage.client.delete(key)
+
+
+async def run_scenario(client, items: list, requests: int, concurrency: int, alloc_samples: int) -> dict:
+    """
+    Прогон одного сценария
+    """
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i: int):
+        nonlocal errors
+        event_type, body, signature = items[i % len(items)]
+        headers = {
+            "Content-Type": "application/json",
+            "X-GitHub-Event": event_type,
+            "X-GitHub-Delivery": str(uuid.uuid4()),
+            "X-Hub-Signature-256": signature
+        }
+        async with semaphore:
+            start = time.perf_counter()
+            resp = await client.post("/webhook/github", data=body, headers=headers)
+            await resp.read()
+            latencies.append(time.perf_counter() - start)
+        if resp.status >= 400:
+            errors += 1
+
+    # прогрев
+    for i in range(min(len(items), 5)):
+        await send(i)
+    latencies.clear()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    # отдельный проход для памяти: tracemalloc заметно замедляет выполнение
+    peaks = []
+    tracemalloc.start()
+    for i in range(alloc_samples):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        await send(i)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - current)
+    tracemalloc.stop()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(quantiles[98] * 1000, 3),
+        "alloc_kib_per_request": round(statistics.median(peaks) / 1024, 1) if peaks else None
+    }
+
+
+async def run(args) -> dict:
+    """
+    Прогон всех выбранных сценариев
+    """
+
+    from aiohttp.test_utils import TestClient, TestServer
+    from webhook_server import create_app
+
+    Config.WEBHOOK_PROCESSING = args.mode
+    chat_ids = setup_storage(args.fakeredis, args.chats)
+    if not args.telegram_limits:
+        # измеряется конвейер, а не лимиты Telegram: заглушка отправляет без пауз
+        dispatcher.shared_limits = False
+        dispatcher.global_rate = dispatcher.private_rate = dispatcher.group_rate = 1e9
+    notifier = StubNotifier()
+
+    results = {}
+    client = TestClient(TestServer(create_app(notification_func=notifier)))
+    await client.start_server()
+    try:
+        for name, (events, concurrency) in build_scenarios().items():
+            if args.scenario and name not in args.scenario:
+                continue
+            items = []
+            for event_type, payload in events:
+                body = json.dumps(payload).encode()
+                items.append((event_type, body, sign(body)))
+            results[name] = await run_scenario(
+                client, items, args.requests, concurrency, args.alloc_samples
+            )
+            print_result(name, results[name])
+    finally:
+        await client.close()
+        cleanup_storage(chat_ids)
+
+    return {
+        "mode": args.mode,
+        "chats": args.chats,
+        "python": sys.version.split()[0],
+        "scenarios": results
+    }
+
+
+def print_result(name: str, result: dict):
+    print(f"{name:<26}{result['rps']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}"
+          f"{result['alloc_kib_per_request'] or '-':>12}{result['errors']:>8}")
+
+
+def compare(report: dict, baseline_path: Path):
+    """
+    Сравнение с сохранённым baseline
+    """
+
+    baseline = json.loads(baseline_path.read_text())
+    print(f"\nComparison with {baseline_path}:")
+    print(f"{'scenario':<26}{'rps':>10}{'p50':>10}{'p99':>10}{'alloc':>10}")
+    for name, result in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        deltas = []
+        for metric in ("rps", "p50_ms", "p99_ms", "alloc_kib_per_request"):
+            if base.get(metric) and result.get(metric) is not None:
+                deltas.append(f"{(result[metric] - base[metric]) / base[metric] * 100:+.1f}%")
+            else:
+                deltas.append("-")
+        print(f"{name:<26}" + "".join(f"{d:>10}" for d in deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook pipeline benchmark")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--chats", type=int, default=10, help="subscribed chats for the repository")
+    parser.add_argument("--alloc-samples", type=int, default=50, help="requests traced for memory")
+    parser.add_argument("--mode", default="sync", choices=["sync", "queue", "stream"],
+                        help="WEBHOOK_PROCESSING mode")
+    parser.add_argument("--scenario", action="append", help="run only the given scenario(s)")
+    parser.add_argument("--fakeredis", action="store_true", help="use fakeredis instead of local Redis")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="keep Telegram rate limits (stub sends are paced like real ones)")
+    parser.add_argument("--save-baseline", type=Path, help="write results to a JSON file")
+    parser.add_argument("--compare", type=Path, help="compare results with a baseline JSON file")
+    parser.add_argument("--log", action="store_true", help="keep INFO logging (slow)")
+    args = parser.parse_args()
+
+    if not args.log:
+        logging.disable(logging.INFO)
+
+    print(f"{'scenario':<26}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'alloc KiB':>12}{'errors':>8}")
+    report = asyncio.run(run(args))
+
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(report, indent=2))
+        print(f"\nBaseline saved to {args.save_baseline}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
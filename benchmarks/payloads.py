@@ -0,0 +1,273 @@
+"""
+Генераторы синтетических payload'ов GitHub webhook для бенчмарков
+"""
+
+import random
+import string
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+
+REPO_FULL_NAME = "octo-org/octo-repo"
+REPO_URL = f"https://github.com/{REPO_FULL_NAME}"
+
+
+def _sha(rnd: random.Random) -> str:
+    return "".join(rnd.choice("0123456789abcdef") for _ in range(40))
+
+
+def _text(rnd: random.Random, length: int) -> str:
+    alphabet = string.ascii_letters + "      "
+    return "".join(rnd.choice(alphabet) for _ in range(length))
+
+
+def user(login: str) -> dict:
+    """
+    Объект пользователя в формате GitHub
+    """
+
+    return {
+        "login": login,
+        "id": sum(map(ord, login)),
+        "node_id": "MDQ6VXNlcjE=",
+        "avatar_url": f"https://avatars.githubusercontent.com/u/{login}?v=4",
+        "gravatar_id": "",
+        "url": f"https://api.github.com/users/{login}",
+        "html_url": f"https://github.com/{login}",
+        "followers_url": f"https://api.github.com/users/{login}/followers",
+        "following_url": f"https://api.github.com/users/{login}/following{{/other_user}}",
+        "gists_url": f"https://api.github.com/users/{login}/gists{{/gist_id}}",
+        "starred_url": f"https://api.github.com/users/{login}/starred{{/owner}}{{/repo}}",
+        "subscriptions_url": f"https://api.github.com/users/{login}/subscriptions",
+        "organizations_url": f"https://api.github.com/users/{login}/orgs",
+        "repos_url": f"https://api.github.com/users/{login}/repos",
+        "events_url": f"https://api.github.com/users/{login}/events{{/privacy}}",
+        "received_events_url": f"https://api.github.com/users/{login}/received_events",
+        "type": "User",
+        "site_admin": False
+    }
+
+
+def repository(full_name: str = REPO_FULL_NAME) -> dict:
+    """
+    Объект репозитория в формате GitHub (основные поля)
+    """
+
+    owner = full_name.split("/")[0]
+    api = f"https://api.github.com/repos/{full_name}"
+    repo = {
+        "id": 123456789,
+        "node_id": "MDEwOlJlcG9zaXRvcnkxMjM0NTY3ODk=",
+        "name": full_name.split("/")[1],
+        "full_name": full_name,
+        "private": False,
+        "owner": user(owner),
+        "html_url": f"https://github.com/{full_name}",
+        "description": "Synthetic repository for benchmarks",
+        "fork": False,
+        "url": api,
+        "created_at": "2020-01-01T00:00:00Z",
+        "updated_at": "2024-01-01T00:00:00Z",
+        "pushed_at": "2024-01-01T00:00:00Z",
+        "git_url": f"git://github.com/{full_name}.git",
+        "ssh_url": f"git@github.com:{full_name}.git",
+        "clone_url": f"https://github.com/{full_name}.git",
+        "homepage": None,
+        "size": 10240,
+        "stargazers_count": 150,
+        "watchers_count": 150,
+        "language": "Python",
+        "forks_count": 12,
+        "open_issues_count": 7,
+        "default_branch": "main",
+        "topics": ["bot", "github", "telegram"],
+        "visibility": "public"
+    }
+    for name in ("forks", "keys", "collaborators", "teams", "hooks", "issue_events", "events",
+                 "assignees", "branches", "tags", "blobs", "git_tags", "git_refs", "trees",
+                 "statuses", "languages", "stargazers", "contributors", "subscribers",
+                 "subscription", "commits", "git_commits", "comments", "issue_comment",
+                 "contents", "compare", "merges", "archive", "downloads", "issues", "pulls",
+                 "milestones", "notifications", "labels", "releases", "deployments"):
+        repo[f"{name}_url"] = f"{api}/{name}"
+    return repo
+
+
+def push_payload(commits: int = 3, ref: str = "refs/heads/main", seed: int = 1) -> dict:
+    """
+    Payload события push с заданным числом коммитов
+    """
+
+    rnd = random.Random(seed)
+    commit_list = []
+    for i in range(commits):
+        sha = _sha(rnd)
+        author = {"name": f"Dev {i % 5}", "email": f"dev{i % 5}@example.com", "username": f"dev{i % 5}"}
+        commit_list.append({
+            "id": sha,
+            "tree_id": _sha(rnd),
+            "distinct": True,
+            "message": f"Commit {i}: {_text(rnd, 60)}\n\n{_text(rnd, 200)}",
+            "timestamp": "2024-01-01T00:00:00Z",
+            "url": f"{REPO_URL}/commit/{sha}",
+            "author": author,
+            "committer": author,
+            "added": [f"services/api/new_{i}.py"],
+            "removed": [],
+            "modified": [f"services/api/module_{j}.py" for j in range(3)]
+        })
+
+    return {
+        "ref": ref,
+        "before": _sha(rnd),
+        "after": _sha(rnd),
+        "repository": repository(),
+        "pusher": {"name": "dev0", "email": "dev0@example.com"},
+        "sender": user("dev0"),
+        "created": False,
+        "deleted": False,
+        "forced": False,
+        "base_ref": None,
+        "compare": f"{REPO_URL}/compare/aaaaaaa...bbbbbbb",
+        "commits": commit_list,
+        "head_commit": commit_list[-1] if commit_list else None,
+        "size": commits
+    }
+
+
+def pull_request_payload(action: str = "opened", body_length: int = 20000,
+                         number: int = 42, seed: int = 2) -> dict:
+    """
+    Payload события pull_request с длинным описанием
+    """
+
+    rnd = random.Random(seed)
+    head_sha = _sha(rnd)
+    pr = {
+        "url": f"https://api.github.com/repos/{REPO_FULL_NAME}/pulls/{number}",
+        "id": 1000 + number,
+        "number": number,
+        "state": "open",
+        "locked": False,
+        "title": f"Feature {number}: {_text(rnd, 40)}",
+        "user": user("contributor"),
+        "body": _text(rnd, body_length),
+        "html_url": f"{REPO_URL}/pull/{number}",
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-01T00:00:00Z",
+        "labels": [{"id": 1, "name": "urgent", "color": "ff0000"}],
+        "head": {"label": "contributor:feature", "ref": "feature", "sha": head_sha,
+                 "user": user("contributor"), "repo": repository()},
+        "base": {"label": "octo-org:main", "ref": "main", "sha": _sha(rnd),
+                 "user": user("octo-org"), "repo": repository()},
+        "merged": False,
+        "commits": 5,
+        "additions": 120,
+        "deletions": 30,
+        "changed_files": 7
+    }
+    return {
+        "action": action,
+        "number": number,
+        "pull_request": pr,
+        "repository": repository(),
+        "sender": user("contributor")
+    }
+
+
+def workflow_run_payload(action: str = "completed", run_id: int = 1, seed: int = 3) -> dict:
+    """
+    Payload события workflow_run
+    """
+
+    rnd = random.Random(seed + run_id)
+    status = "completed" if action == "completed" else ("queued" if action == "requested" else "in_progress")
+    return {
+        "action": action,
+        "workflow_run": {
+            "id": run_id,
+            "name": "CI",
+            "head_branch": "main",
+            "head_sha": _sha(rnd),
+            "run_number": run_id,
+            "event": "push",
+            "status": status,
+            "conclusion": "success" if action == "completed" else None,
+            "html_url": f"{REPO_URL}/actions/runs/{run_id}",
+            "actor": user("dev0"),
+            "created_at": "2024-01-01T00:00:00Z",
+            "updated_at": "2024-01-01T00:00:00Z"
+        },
+        "workflow": {"id": 7, "name": "CI", "path": ".github/workflows/ci.yml"},
+        "repository": repository(),
+        "sender": user("dev0")
+    }
+
+
+def issues_payload(action: str = "opened", number: int = 7) -> dict:
+    """
+    Payload события issues
+    """
+
+    return {
+        "action": action,
+        "issue": {
+            "number": number,
+            "title": "Something is broken",
+            "body": "Steps to reproduce...\n" * 20,
+            "html_url": f"{REPO_URL}/issues/{number}",
+            "user": user("reporter"),
+            "labels": [{"name": "bug"}]
+        },
+        "repository": repository(),
+        "sender": user("reporter")
+    }
+
+
+def issue_comment_payload(number: int = 7, comment_id: int = 99) -> dict:
+    """
+    Payload события issue_comment
+    """
+
+    payload = issues_payload("created", number)
+    payload["comment"] = {
+        "id": comment_id,
+        "body": "I can reproduce this too.",
+        "html_url": f"{REPO_URL}/issues/{number}#issuecomment-{comment_id}",
+        "user": user("commenter")
+    }
+    payload["sender"] = user("commenter")
+    return payload
+
+
+def pr_review_comment_payload(number: int = 42, comment_id: int = 555) -> dict:
+    """
+    Payload события pull_request_review_comment
+    """
+
+    payload = pull_request_payload("created", body_length=500, number=number)
+    payload["comment"] = {
+        "id": comment_id,
+        "body": "Consider extracting this into a helper.",
+        "path": "services/api/module_1.py",
+        "html_url": f"{REPO_URL}/pull/{number}#discussion_r{comment_id}",
+        "user": user("reviewer")
+    }
+    payload["sender"] = user("reviewer")
+    return payload
+
+
+def create_payload(ref: str = "v1.0.0", ref_type: str = "tag") -> dict:
+    """
+    Payload события create (ветка/тег)
+    """
+
+    return {
+        "ref": ref,
+        "ref_type": ref_type,
+        "master_branch": "main",
+        "repository": repository(),
+        "sender": user("dev0")
+    }
@@ -1,15 +1,26 @@
 import asyncio
+import html
 import logging
+import time
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramMigrateToChat,
+    TelegramRetryAfter
+)
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
 from config import Config
+from delivery import DeliveryResult, SENT, EDITED, UNCHANGED, FAILED, GONE, TRANSIENT_ERRORS, fan_out
+from filters import RULES, parse_patterns
 from redis_storage import storage
 from github_api import github_api
+from metrics import CHATS_PRUNED_TOTAL
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,6 +38,7 @@ class FilterStates(StatesGroup):
     waiting_for_filter_action = State()
     waiting_for_author = State()
     waiting_for_events = State()
+    waiting_for_rule_patterns = State()
 
 
 # === Клавиатура с кнопками ===
@@ -55,6 +67,30 @@ def get_main_keyboard():
     return keyboard
 
 
+def format_filter_rules(filters: dict) -> str:
+    """
+    Заданные расширенные правила фильтра, по строке на правило
+    """
+
+    text = ""
+    for rule, title in RULES.items():
+        patterns = filters.get(rule)
+        if patterns:
+            text += f"{title}: {html.escape(', '.join(patterns))}\n"
+    return text
+
+
+def format_quota(filters: dict) -> str:
+    """
+    Квота событий подписки для меню фильтров
+    """
+
+    quota = filters.get("quota") if filters else None
+    if not quota:
+        return "нет"
+    return f"{quota} за {Config.QUOTA_WINDOW // 60} мин"
+
+
 # === Обработчики кнопок (должны быть первыми!) ===
 
 @dp.message(F.text == "📝 Подписаться")
@@ -98,6 +134,9 @@ async def button_list(message: types.Message, state: FSMContext):
             text += f"События: все\n"
         if excluded:
             text += f"Исключены: {', '.join(excluded)}\n"
+        text += format_filter_rules(filters)
+        if filters.get("quota"):
+            text += f"Квота: {format_quota(filters)}\n"
         text += "\n"
 
     await message.answer(text, parse_mode="HTML", disable_web_page_preview=True)
@@ -178,6 +217,8 @@ async def button_help(message: types.Message, state: FSMContext):
    ⚙️ Фильтры - выбрать репозиторий - настроить:
    • Исключить авторов (например, dependabot[bot])
    • Выбрать типы событий (push, issues, pull_request, workflow_run)
+   • Ограничить ветки, пути, метки и workflow (например, main, release/*)
+   • Квота событий - сверх неё события приходят одной сводкой
    • Группировать сообщения (ВКЛ/ВЫКЛ)
 
 3️⃣ <b>Просмотр подписок</b>
@@ -239,6 +280,8 @@ async def cmd_help(message: types.Message):
    ⚙️ Фильтры - выбрать репозиторий - настроить:
    • Исключить авторов (например, dependabot[bot])
    • Выбрать типы событий (push, issues, pull_request, workflow_run)
+   • Ограничить ветки, пути, метки и workflow (например, main, release/*)
+   • Квота событий - сверх неё события приходят одной сводкой
    • Группировать сообщения (ВКЛ/ВЫКЛ)
 
 3️⃣ <b>Просмотр подписок</b>
@@ -369,6 +412,9 @@ async def cmd_list(message: types.Message):
             text += f"События: все\n"
         if excluded:
             text += f"Исключены: {', '.join(excluded)}\n"
+        text += format_filter_rules(filters)
+        if filters.get("quota"):
+            text += f"Квота: {format_quota(filters)}\n"
         text += "\n"
 
     await message.answer(text, parse_mode="HTML", disable_web_page_preview=True)
@@ -401,6 +447,108 @@ async def cmd_unsubscribe(message: types.Message):
     )
 
 
+def is_admin(message: types.Message) -> bool:
+    """
+    Пользователь указан в ADMIN_USER_IDS
+    """
+
+    return message.from_user is not None and message.from_user.id in Config.ADMIN_USER_IDS
+
+
+@dp.message(Command("dlq"))
+async def cmd_dead_letters(message: types.Message):
+    """
+    Просмотр недоставленных сообщений (только для администраторов)
+    """
+
+    if not is_admin(message):
+        return
+
+    entries, total = await asyncio.to_thread(storage.get_dead_letters, 10)
+    if not total:
+        await message.answer("Очередь недоставленных сообщений пуста")
+        return
+
+    text = f"<b>Недоставленные сообщения: {total}</b>\n\n"
+    for entry in entries:
+        preview = html.escape(entry.get("text", "")[:80].replace("\n", " "))
+        failed_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(entry.get("failed_at", 0)))
+        text += (f"<code>{entry.get('chat_id')}</code> {failed_at} UTC, "
+                 f"попыток: {entry.get('attempts')}\n"
+                 f"{html.escape(entry.get('error', ''))}\n"
+                 f"<i>{preview}</i>\n\n")
+    text += "Повторить отправку: /dlq_replay [количество]"
+
+    await message.answer(text, parse_mode="HTML")
+
+
+# фоновые повторные отправки из dead-letter очереди (/dlq_replay)
+replay_tasks = set()
+
+
+@dp.message(Command("dlq_replay"))
+async def cmd_replay_dead_letters(message: types.Message, command: CommandObject):
+    """
+    Повторная отправка самых старых недоставленных сообщений (только для администраторов).
+    Отправки идут в фоне, итог приходит отдельным сообщением
+    """
+
+    if not is_admin(message):
+        return
+
+    count = int(command.args) if command.args and command.args.strip().isdigit() else 100
+    entries = await asyncio.to_thread(storage.pop_dead_letters, count)
+    if not entries:
+        await message.answer("Очередь недоставленных сообщений пуста")
+        return
+
+    task = asyncio.create_task(replay_dead_letters(message, entries))
+    replay_tasks.add(task)
+    task.add_done_callback(replay_tasks.discard)
+    await message.answer(f"Повторная отправка запущена: {len(entries)}")
+
+
+async def replay_dead_letters(message: types.Message, entries: list):
+    """
+    Поставить записи dead-letter очереди в очереди чатов и дождаться итога.
+    Записи, которые снова не удалось отправить, возвращаются в очередь
+    (сама рассылка их не сохраняет, чтобы запись не попала туда дважды)
+    """
+
+    summaries = []
+    for entry in entries:
+        summaries.append(await fan_out(
+            send_notification,
+            [entry["chat_id"]],
+            entry["text"],
+            event_key=entry.get("event_key"),
+            edit_existing=entry.get("edit_existing", False),
+            description=f"dead letter replay ({entry.get('description') or entry.get('event_key')})",
+            dead_letter=False
+        ))
+    outcomes = await asyncio.gather(*summaries, return_exceptions=True)
+
+    sent = failed = 0
+    for entry, stats in zip(entries, outcomes):
+        if isinstance(stats, BaseException):
+            # рассылка отменена при остановке
+            stats = {FAILED: 1}
+        sent += stats.get(SENT, 0) + stats.get(EDITED, 0) + stats.get(UNCHANGED, 0)
+        failed += stats.get(FAILED, 0) + stats.get(GONE, 0)
+        if stats.get(FAILED):
+            try:
+                await asyncio.to_thread(storage.push_dead_letter, dict(entry, failed_at=int(time.time())),
+                                        Config.DEAD_LETTER_MAXLEN)
+            except Exception as e:
+                logger.error(f"Failed to return dead letter for chat {entry['chat_id']}: {e}")
+
+    logger.info(f"Dead letter replay finished: sent={sent} failed={failed}")
+    try:
+        await message.answer(f"Повторно отправлено: {sent}, не удалось: {failed}")
+    except Exception as e:
+        logger.warning(f"Failed to report dead letter replay: {e}")
+
+
 @dp.callback_query(F.data.startswith("unsub:"))
 async def process_unsubscribe(callback: types.CallbackQuery):
     """
@@ -413,16 +561,16 @@ async def process_unsubscribe(callback: types.CallbackQuery):
 
     sub = storage.get_subscription(chat_id, repo_url)
     if sub:
-        # удаляем webhook если есть
+        storage.remove_subscription(chat_id, repo_url)
+        storage.remove_repo_chat_mapping(repo_url, chat_id)
+
+        # webhook общий для всех подписчиков: удаляем, только если их не осталось
         webhook_id = sub.get("webhook_id")
-        if webhook_id:
+        if webhook_id and not storage.get_chats_for_repo(repo_url):
             parsed = github_api.parse_repo_url(repo_url)
             if parsed:
                 github_api.delete_webhook(parsed[0], parsed[1], webhook_id)
 
-        storage.remove_subscription(chat_id, repo_url)
-        storage.remove_repo_chat_mapping(repo_url, chat_id)
-
         await callback.message.edit_text(f"Отписка от {repo_url} выполнена!")
     else:
         await callback.message.edit_text("Подписка не найдена")
@@ -476,6 +624,8 @@ async def process_filter_repo(callback: types.CallbackQuery, state: FSMContext):
         [InlineKeyboardButton(text="Исключить автора", callback_data="filter:add_author")],
         [InlineKeyboardButton(text="Удалить из исключений", callback_data="filter:remove_author")],
         [InlineKeyboardButton(text="Типы событий", callback_data="filter:events")],
+        [InlineKeyboardButton(text="Ветки, пути, метки, workflow", callback_data="filter:rules")],
+        [InlineKeyboardButton(text=f"Квота событий: {format_quota(filters)}", callback_data="filter:quota")],
         [InlineKeyboardButton(text=f"Группировать сообщения: {group_status}", callback_data="filter:toggle_group")],
         [InlineKeyboardButton(text="Отмена", callback_data="filter:cancel")]
     ])
@@ -486,6 +636,8 @@ async def process_filter_repo(callback: types.CallbackQuery, state: FSMContext):
         events = filters.get('event_types', [])
         text += f"Исключённые авторы: {', '.join(excluded) if excluded else 'не выбрано'}\n"
         text += f"Типы событий: {', '.join(events) if events else 'все'}\n"
+        text += format_filter_rules(filters)
+        text += f"Квота событий: {format_quota(filters)}\n"
         text += f"Группировать сообщения: {'включено' if group_events else 'выключено'}"
     else:
         text += "Фильтры не настроены"
@@ -683,6 +835,8 @@ async def filter_toggle_group(callback: types.CallbackQuery, state: FSMContext):
         [InlineKeyboardButton(text="Исключить автора", callback_data="filter:add_author")],
         [InlineKeyboardButton(text="Удалить из исключений", callback_data="filter:remove_author")],
         [InlineKeyboardButton(text="Типы событий", callback_data="filter:events")],
+        [InlineKeyboardButton(text="Ветки, пути, метки, workflow", callback_data="filter:rules")],
+        [InlineKeyboardButton(text=f"Квота событий: {format_quota(filters)}", callback_data="filter:quota")],
         [InlineKeyboardButton(text=f"Группировать сообщения: {group_status}", callback_data="filter:toggle_group")],
         [InlineKeyboardButton(text="Отмена", callback_data="filter:cancel")]
     ])
@@ -695,12 +849,145 @@ async def filter_toggle_group(callback: types.CallbackQuery, state: FSMContext):
         events = filters.get('event_types', [])
         text += f"Исключённые авторы: {', '.join(excluded) if excluded else 'не выбрано'}\n"
         text += f"Типы событий: {', '.join(events) if events else 'все'}\n"
+        text += format_filter_rules(filters)
+        text += f"Квота событий: {format_quota(filters)}\n"
         text += f"Группировать сообщения: {'включено ✅' if new_group else 'выключено ❌'}"
 
     await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
     await callback.answer(f"Группировка сообщений {'включена' if new_group else 'выключена'}")
 
 
+@dp.callback_query(F.data == "filter:rules")
+async def filter_rules(callback: types.CallbackQuery, state: FSMContext):
+    """
+    Выбор расширенного правила фильтра
+    """
+
+    data = await state.get_data()
+    repo_url = data.get("repo_url")
+    filters = storage.get_filters(callback.message.chat.id, repo_url) or {}
+
+    keyboard = []
+    for rule, title in RULES.items():
+        patterns = filters.get(rule)
+        keyboard.append([InlineKeyboardButton(
+            text=f"{title}: {', '.join(patterns) if patterns else 'все'}",
+            callback_data=f"edit_rule:{rule}"
+        )])
+    keyboard.append([InlineKeyboardButton(text="Отмена", callback_data="filter:cancel")])
+
+    await callback.message.edit_text(
+        "Выберите правило для настройки:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("edit_rule:"))
+async def filter_edit_rule(callback: types.CallbackQuery, state: FSMContext):
+    """
+    Запрос шаблонов для расширенного правила
+    """
+
+    rule = callback.data.replace("edit_rule:", "")
+    if rule not in RULES:
+        await callback.answer("Неизвестное правило", show_alert=True)
+        return
+
+    examples = {
+        "branches": "main, release/*",
+        "paths": "services/api/**, *.md",
+        "labels": "urgent, bug",
+        "workflows": "CI, Deploy *",
+        "conclusions": "failure, cancelled",
+    }
+    await callback.message.edit_text(
+        f"<b>{RULES[rule]}</b>\n\n"
+        f"Введите значения через запятую.\n"
+        f"Например: <code>{examples[rule]}</code>\n\n"
+        f"* - любые символы кроме /, ** - любые символы.\n"
+        f"Отправьте <code>-</code>, чтобы снять ограничение",
+        parse_mode="HTML"
+    )
+    await state.set_state(FilterStates.waiting_for_rule_patterns)
+    await state.update_data(rule=rule)
+    await callback.answer()
+
+
+@dp.message(FilterStates.waiting_for_rule_patterns)
+async def process_rule_patterns(message: types.Message, state: FSMContext):
+    """
+    Сохранение шаблонов расширенного правила
+    """
+
+    data = await state.get_data()
+    repo_url = data.get("repo_url")
+    rule = data.get("rule")
+
+    text = message.text.strip()
+    patterns = [] if text == "-" else parse_patterns(text)
+
+    storage.set_filter_rule(message.chat.id, repo_url, rule, patterns)
+    if patterns:
+        await message.answer(
+            f"{RULES[rule]}: <code>{html.escape(', '.join(patterns))}</code>",
+            parse_mode="HTML"
+        )
+    else:
+        await message.answer(f"{RULES[rule]}: ограничение снято")
+
+    await state.clear()
+
+
+@dp.callback_query(F.data == "filter:quota")
+async def filter_quota(callback: types.CallbackQuery, state: FSMContext):
+    """
+    Выбор квоты событий: сверх неё события собираются в одно обновляемое сообщение
+    """
+
+    data = await state.get_data()
+    repo_url = data.get("repo_url")
+    filters = storage.get_filters(callback.message.chat.id, repo_url)
+    current = filters.get("quota", 0) if filters else 0
+
+    keyboard = []
+    for quota in (0, 10, 30, 60, 120):
+        status = "✅ " if quota == current else ""
+        keyboard.append([InlineKeyboardButton(
+            text=f"{status}{quota if quota else 'Без квоты'}",
+            callback_data=f"set_quota:{quota}"
+        )])
+    keyboard.append([InlineKeyboardButton(text="Отмена", callback_data="filter:cancel")])
+
+    await callback.message.edit_text(
+        f"Сколько событий за {Config.QUOTA_WINDOW // 60} мин отправлять отдельными сообщениями?\n"
+        f"Остальные будут собраны в одну периодически обновляемую сводку",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("set_quota:"))
+async def process_set_quota(callback: types.CallbackQuery, state: FSMContext):
+    """
+    Сохранение квоты событий
+    """
+
+    quota = int(callback.data.replace("set_quota:", ""))
+    data = await state.get_data()
+    repo_url = data.get("repo_url")
+
+    storage.set_event_quota(callback.message.chat.id, repo_url, quota)
+    if quota:
+        await callback.message.edit_text(
+            f"Квота: {quota} событий за {Config.QUOTA_WINDOW // 60} мин, остальные - сводкой"
+        )
+    else:
+        await callback.message.edit_text("Квота событий отключена")
+    await state.clear()
+    await callback.answer()
+
+
 @dp.callback_query(F.data == "filter:cancel")
 async def filter_cancel(callback: types.CallbackQuery, state: FSMContext):
     """
@@ -712,38 +999,95 @@ async def filter_cancel(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-async def send_notification(chat_id: int, text: str, event_key: str = None,
-                            edit_existing: bool = False) -> int:
+# ошибки Telegram, после которых чат больше не сможет получать сообщения
+CHAT_GONE_ERRORS = ("chat not found", "group chat was deactivated", "chat was deleted")
+
+
+def is_chat_gone(error: Exception) -> bool:
     """
-    Отправить или отредактировать уведомление
+    Постоянная ошибка доставки: бот заблокирован, исключён из группы или чат удалён
     """
 
-    if edit_existing and event_key:
-        existing_msg_id = storage.get_message_id(chat_id, event_key)
-        if existing_msg_id:
-            try:
-                await bot.edit_message_text(
-                    text=text,
-                    chat_id=chat_id,
-                    message_id=existing_msg_id,
-                    parse_mode="HTML",
-                    disable_web_page_preview=True
-                )
-                return existing_msg_id
-            except Exception:
-                pass  # отправка нового при неудачном редактировании
-
-    msg = await bot.send_message(
-        chat_id=chat_id,
-        text=text,
-        parse_mode="HTML",
-        disable_web_page_preview=True
-    )
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    if isinstance(error, TelegramBadRequest):
+        message = str(error).lower()
+        return any(text in message for text in CHAT_GONE_ERRORS)
+    return False
+
+
+async def prune_chat(chat_id: int, reason: Exception):
+    """
+    Удалить подписки недоступного чата и вебхуки репозиториев, оставшихся без подписчиков
+    """
 
-    if event_key:
-        storage.save_message_id(chat_id, event_key, msg.message_id)
+    orphaned = await asyncio.to_thread(storage.remove_chat, chat_id)
+    CHATS_PRUNED_TOTAL.inc(type(reason).__name__)
+    logger.warning(f"Chat {chat_id} is unavailable ({reason}), subscriptions removed")
 
-    return msg.message_id
+    for repo_url, webhook_id in orphaned.items():
+        parsed = github_api.parse_repo_url(repo_url)
+        if webhook_id and parsed:
+            deleted = await asyncio.to_thread(github_api.delete_webhook, parsed[0], parsed[1], webhook_id)
+            logger.info(f"Webhook {webhook_id} of {repo_url} without subscribers "
+                        f"{'deleted' if deleted else 'could not be deleted'}")
+
+
+async def send_notification(chat_id: int, text: str, event_key: str = None,
+                            edit_existing: bool = False, message_id: int = None) -> DeliveryResult:
+    """
+    Отправить или отредактировать уведомление.
+    message_id - ранее отправленное сообщение события (ID сохраняет рассылка, см. delivery.py).
+    Подписки недоступного чата удаляются, группа, ставшая супергруппой, переносится на новый ID
+    """
+
+    if edit_existing and message_id:
+        try:
+            await bot.edit_message_text(
+                text=text,
+                chat_id=chat_id,
+                message_id=message_id,
+                parse_mode="HTML",
+                disable_web_page_preview=True
+            )
+            return DeliveryResult(EDITED, message_id)
+        except (TelegramRetryAfter, *TRANSIENT_ERRORS):
+            raise  # повтор после паузы выполнит планировщик доставки
+        except TelegramBadRequest as e:
+            # текст совпадает с отправленным - это не ошибка
+            if "message is not modified" in str(e).lower():
+                return DeliveryResult(UNCHANGED, message_id)
+            # сообщение удалено или его нельзя редактировать - отправка нового
+            logger.info(f"Cannot edit message {message_id} in chat {chat_id}: {e}")
+        except Exception as e:
+            logger.warning(f"Failed to edit message {message_id} in chat {chat_id}: {e}")
+
+    try:
+        msg = await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode="HTML",
+            disable_web_page_preview=True
+        )
+    except TelegramMigrateToChat as e:
+        new_chat_id = e.migrate_to_chat_id
+        logger.info(f"Chat {chat_id} migrated to supergroup {new_chat_id}, moving subscriptions")
+        await asyncio.to_thread(storage.migrate_chat, chat_id, new_chat_id)
+        msg = await bot.send_message(
+            chat_id=new_chat_id,
+            text=text,
+            parse_mode="HTML",
+            disable_web_page_preview=True
+        )
+        # ID сообщения сохраняется под новым ID чата, иначе следующее обновление придёт дублем
+        return DeliveryResult(SENT, msg.message_id, new_chat_id)
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        if not is_chat_gone(e):
+            raise
+        await prune_chat(chat_id, e)
+        return DeliveryResult(GONE)
+
+    return DeliveryResult(SENT, msg.message_id)
 
 
 async def start_bot():
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+
+import redis
+
+from config import Config
+from redis_storage import storage
+
+logger = logging.getLogger(__name__)
+
+# действия, после которых обновлений события уже не будет - отправляются сразу
+TERMINAL_ACTIONS = {
+    "workflow_run": {"completed"},
+    "pull_request": {"closed"},
+}
+
+
+def is_terminal_update(event_type: str, payload: dict) -> bool:
+    """
+    Финальное состояние события (workflow завершён, PR закрыт)
+    """
+
+    return payload.get("action") in TERMINAL_ACTIONS.get(event_type, ())
+
+
+# сколько хранится номер последнего обновления события (секунды)
+UPDATE_COUNT_TTL = 3600
+
+
+class EventCoalescer:
+    """
+    Склейка частых обновлений одного события (event_key) в одну отправку за окно.
+    Обновление откладывается на window секунд; пришедшие за это время заменяют его,
+    и отправляется только последнее состояние. Финальное состояние отправляется сразу.
+    Обновления одного события могут прийти в разные процессы, поэтому каждое обновление
+    получает номер в Redis, и отложенное состояние не отправляется, если после него
+    пришло более новое (его отправит процесс, который его получил).
+    on_done отложенного обновления (например, XACK записи stream) вызывается, когда оно
+    отправлено или заменено более новым, поэтому при падении процесса в окне склейки
+    событие остаётся неподтверждённым и будет обработано повторно
+    """
+
+    def __init__(self, window: float = 3):
+        self.window = window
+        self.pending = {}  # event_key -> (последняя отложенная отправка, номер обновления, on_done)
+        self.timers = {}   # event_key -> задача отложенной отправки
+
+    async def submit(self, event_key: str, deliver, terminal: bool = False, on_done=None) -> bool:
+        """
+        Передать обновление события. deliver - корутинная функция без аргументов,
+        форматирующая и рассылающая это состояние, on_done - корутинная функция без аргументов.
+        Возвращает True, если обновление отложено: тогда on_done будет вызвана после его
+        отправки или замены. При False обновление уже обработано, и on_done не вызывается
+        """
+
+        if self.window <= 0:
+            await deliver()
+            return False
+
+        number = await self._count_update(event_key)
+
+        if terminal:
+            # отложенное промежуточное состояние больше не нужно
+            previous = self.pending.pop(event_key, None)
+            timer = self.timers.pop(event_key, None)
+            if timer:
+                timer.cancel()
+            try:
+                await deliver()
+            finally:
+                if previous:
+                    await self._done(event_key, previous[2])
+            return False
+
+        previous = self.pending.get(event_key)
+        self.pending[event_key] = (deliver, number, on_done)
+        if previous:
+            logger.debug(f"Coalesced update of {event_key}")
+            await self._done(event_key, previous[2])
+        if event_key not in self.timers:
+            self.timers[event_key] = asyncio.create_task(self._flush_later(event_key))
+        return True
+
+    async def stop(self):
+        """
+        Отправить все отложенные обновления (при остановке процесса)
+        """
+
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+
+        pending, self.pending = self.pending, {}
+        for event_key, (deliver, number, on_done) in pending.items():
+            await self._deliver(event_key, deliver, number, on_done)
+
+    async def _count_update(self, event_key: str):
+        """
+        Номер обновления события в Redis (None при ошибке Redis)
+        """
+
+        try:
+            return await asyncio.to_thread(storage.count_event_update, event_key, UPDATE_COUNT_TTL)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to count update of {event_key}: {e}")
+            return None
+
+    async def _is_superseded(self, event_key: str, number) -> bool:
+        """
+        После отложенного обновления пришло более новое (возможно, в другой процесс)
+        """
+
+        if number is None:
+            return False
+        try:
+            latest = await asyncio.to_thread(storage.get_event_update_count, event_key)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to check updates of {event_key}: {e}")
+            return False
+        return latest > number
+
+    async def _flush_later(self, event_key: str):
+        await asyncio.sleep(self.window)
+        self.timers.pop(event_key, None)
+        pending = self.pending.pop(event_key, None)
+        if pending:
+            await self._deliver(event_key, *pending)
+
+    async def _deliver(self, event_key: str, deliver, number, on_done):
+        try:
+            if await self._is_superseded(event_key, number):
+                logger.debug(f"Dropped update of {event_key} superseded by a newer one")
+                return
+            await deliver()
+        except Exception as e:
+            logger.error(f"Failed to deliver coalesced update of {event_key}: {e}", exc_info=True)
+        finally:
+            await self._done(event_key, on_done)
+
+    async def _done(self, event_key: str, on_done):
+        """
+        Обновление отправлено или заменено более новым
+        """
+
+        if on_done is None:
+            return
+        try:
+            await on_done()
+        except Exception as e:
+            logger.error(f"Failed to complete update of {event_key}: {e}", exc_info=True)
+
+
+coalescer = EventCoalescer(window=Config.COALESCE_WINDOW)
@@ -22,6 +22,78 @@ class Config:
     WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
     WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "secret")
 
+    # Максимальный размер тела вебхука (GitHub ограничивает payload 25 МБ)
+    WEBHOOK_MAX_BODY_SIZE = int(os.getenv("WEBHOOK_MAX_BODY_SIZE", 25 * 1024 * 1024))
+    # Начиная с этого размера тела HMAC считается в отдельном потоке
+    WEBHOOK_HASH_THREAD_THRESHOLD = int(os.getenv("WEBHOOK_HASH_THREAD_THRESHOLD", 1024 * 1024))
+
+    # Число процессов приёма вебхуков (SO_REUSEPORT). 1 - сервер в процессе бота
+    WEBHOOK_PROCESSES = int(os.getenv("WEBHOOK_PROCESSES", 1))
+
+    # Обработка событий: sync - внутри запроса, queue - фоновыми воркерами (ответ 202 сразу),
+    # stream - через Redis Streams (воркеры можно запускать отдельно: delivery_worker.py)
+    WEBHOOK_PROCESSING = os.getenv("WEBHOOK_PROCESSING", "sync")
+    WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
+
+    # Redis Streams (для WEBHOOK_PROCESSING=stream)
+    REDIS_STREAM_KEY = os.getenv("REDIS_STREAM_KEY", "github_events")
+    REDIS_STREAM_GROUP = os.getenv("REDIS_STREAM_GROUP", "delivery")
+    REDIS_STREAM_MAXLEN = int(os.getenv("REDIS_STREAM_MAXLEN", 10000))
+    REDIS_STREAM_CLAIM_IDLE_MS = int(os.getenv("REDIS_STREAM_CLAIM_IDLE_MS", 60000))
+
+    # Отсев повторных доставок по X-GitHub-Delivery
+    DELIVERY_DEDUP_TTL = int(os.getenv("DELIVERY_DEDUP_TTL", 86400))
+    DELIVERY_DEDUP_LRU_SIZE = int(os.getenv("DELIVERY_DEDUP_LRU_SIZE", 10000))
+
+    # Период полной сверки множества репозиториев с подписчиками (секунды)
+    SUBSCRIBED_REPOS_RESYNC_INTERVAL = int(os.getenv("SUBSCRIBED_REPOS_RESYNC_INTERVAL", 300))
+
+    # Время жизни кэша коммитов PR (секунды)
+    PR_COMMITS_CACHE_TTL = int(os.getenv("PR_COMMITS_CACHE_TTL", 3600))
+
+    # Отбор получателей: index - индекс в памяти процесса, lua - скрипт внутри Redis
+    ROUTING_MODE = os.getenv("ROUTING_MODE", "index")
+
+    # Максимум одновременных отправок при рассылке без очередей доставки
+    # (процессы без dispatcher: bot.py отдельно, опрос Events API)
+    FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", 20))
+
+    # Упорядоченная доставка: число очередей (по хэшу chat_id) и размер каждой
+    DELIVERY_PARTITIONS = int(os.getenv("DELIVERY_PARTITIONS", 16))
+    DELIVERY_PARTITION_QUEUE_SIZE = int(os.getenv("DELIVERY_PARTITION_QUEUE_SIZE", 1000))
+
+    # Лимиты Telegram: сообщений в секунду всего и в личный чат, сообщений в минуту в группу
+    TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+    TELEGRAM_PRIVATE_CHAT_RATE = float(os.getenv("TELEGRAM_PRIVATE_CHAT_RATE", 1))
+    TELEGRAM_GROUP_CHAT_RATE = float(os.getenv("TELEGRAM_GROUP_CHAT_RATE", 20))
+    # Где считаются лимиты: redis - общие для всех процессов доставки, local - в памяти процесса
+    TELEGRAM_RATE_LIMITS = os.getenv("TELEGRAM_RATE_LIMITS", "redis")
+
+    # Повторы при временных ошибках отправки и dead-letter очередь
+    DELIVERY_MAX_RETRIES = int(os.getenv("DELIVERY_MAX_RETRIES", 5))
+    DELIVERY_RETRY_BASE_DELAY = float(os.getenv("DELIVERY_RETRY_BASE_DELAY", 1))
+    DELIVERY_RETRY_MAX_DELAY = float(os.getenv("DELIVERY_RETRY_MAX_DELAY", 60))
+    DEAD_LETTER_MAXLEN = int(os.getenv("DEAD_LETTER_MAXLEN", 1000))
+
+    # Telegram ID администраторов бота через запятую (команды /dlq, /dlq_replay)
+    ADMIN_USER_IDS = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").split(",") if x.strip()}
+
+    # Время хранения ID сообщений события для последующего редактирования (секунды)
+    EVENT_MESSAGES_TTL = int(os.getenv("EVENT_MESSAGES_TTL", 86400))
+
+    # Окно склейки обновлений workflow_run и pull_request в одно редактирование (секунды, 0 - выкл.)
+    COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", 3))
+
+    # Группировка событий вебхуков: окно (секунды), максимум событий в сообщении, период проверки
+    GROUP_WINDOW = int(os.getenv("GROUP_WINDOW", 60))
+    GROUP_MAX_EVENTS = int(os.getenv("GROUP_MAX_EVENTS", 20))
+    GROUP_FLUSH_INTERVAL = float(os.getenv("GROUP_FLUSH_INTERVAL", 5))
+
+    # Квоты событий чатов: окно (секунды) и период обновления сводки сверх квоты
+    QUOTA_WINDOW = int(os.getenv("QUOTA_WINDOW", 600))
+    QUOTA_SUMMARY_INTERVAL = int(os.getenv("QUOTA_SUMMARY_INTERVAL", 60))
+
     @classmethod
     def get_webhook_url(cls) -> str:
         return f"{cls.WEBHOOK_HOST}/webhook/github"
@@ -0,0 +1,64 @@
+import logging
+import time
+from collections import OrderedDict
+
+import redis
+
+from redis_storage import storage
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryDeduplicator:
+    """
+    Отсев повторных доставок GitHub по X-GitHub-Delivery.
+    Недавние GUID хранятся в LRU процесса, общий список - в Redis (SET NX с TTL)
+    """
+
+    def __init__(self, ttl: int = 86400, lru_size: int = 10000):
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self.seen = OrderedDict()  # delivery_id -> время истечения
+
+    def is_duplicate(self, delivery_id: str) -> bool:
+        """
+        Проверить доставку и отметить её как увиденную
+        """
+
+        if not delivery_id:
+            return False
+
+        now = time.monotonic()
+        expires_at = self.seen.get(delivery_id)
+        if expires_at is not None:
+            if expires_at > now:
+                self.seen.move_to_end(delivery_id)
+                return True
+            del self.seen[delivery_id]
+
+        try:
+            first_seen = storage.mark_delivery_seen(delivery_id, self.ttl)
+        except redis.RedisError as e:
+            # при недоступности Redis лучше продублировать, чем потерять событие
+            logger.warning(f"Failed to check delivery {delivery_id} in Redis: {e}")
+            first_seen = True
+
+        self.seen[delivery_id] = now + self.ttl
+        if len(self.seen) > self.lru_size:
+            self.seen.popitem(last=False)
+
+        return not first_seen
+
+    def forget(self, delivery_id: str):
+        """
+        Снять отметку, чтобы повторная доставка была обработана (например, после ошибки)
+        """
+
+        if not delivery_id:
+            return
+
+        self.seen.pop(delivery_id, None)
+        try:
+            storage.forget_delivery(delivery_id)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to forget delivery {delivery_id}: {e}")
@@ -0,0 +1,605 @@
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from functools import partial
+from typing import NamedTuple, Optional
+
+import redis
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+
+from config import Config
+from metrics import (
+    STAGE_DURATION,
+    SEND_FAILURES_TOTAL,
+    DELIVERY_QUEUE_DEPTH,
+    DELIVERY_PARKED_CHATS,
+    DEAD_LETTERS_TOTAL
+)
+from redis_storage import storage
+
+logger = logging.getLogger(__name__)
+
+# результаты доставки в отдельный чат
+SENT = "sent"
+EDITED = "edited"
+FAILED = "failed"
+GONE = "gone"  # чат недоступен навсегда, подписки удалены
+UNCHANGED = "unchanged"  # текст не изменился, редактирование не требуется
+
+# временные ошибки отправки, после которых имеет смысл повторить попытку
+TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, ConnectionError)
+
+# как часто удалять из памяти вёдра чатов без отправок (секунды)
+BUCKET_SWEEP_INTERVAL = 60
+
+
+class DeliveryResult(NamedTuple):
+    """
+    Результат отправки уведомления в чат
+    """
+
+    status: str
+    message_id: Optional[int] = None
+    chat_id: Optional[int] = None  # новый ID чата, если группа стала супергруппой
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше capacity
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """
+        Сколько секунд ждать следующего токена (0 - токен есть)
+        """
+
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        """
+        Ведро наполнилось и ничем не отличается от нового
+        """
+
+        self.delay()
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("func", "future", "attempts", "dead_letter", "skip")
+
+    def __init__(self, func, future: asyncio.Future, dead_letter: dict = None, skip=None):
+        self.func = func
+        self.future = future
+        self.attempts = 0
+        self.dead_letter = dead_letter  # данные для повторной отправки из dead-letter очереди
+        self.skip = skip                # результат без отправки (или None), проверяется до токенов
+
+
+class _Partition:
+    __slots__ = ("ready", "slots", "pending")
+
+    def __init__(self, maxsize: int):
+        self.ready = asyncio.Queue()             # чаты, готовые к отправке (по кругу)
+        self.slots = asyncio.Semaphore(maxsize)  # ограничение очереди партиции
+        self.pending = 0
+
+
+class PartitionedDispatcher:
+    """
+    Планировщик доставки с учётом лимитов Telegram.
+    Чат закреплён за одной из N партиций (по хэшу chat_id), у каждой партиции свой воркер.
+    У каждого чата своя FIFO-очередь, поэтому его сообщения уходят строго по порядку.
+    Воркер обходит чаты партиции по кругу (по одному сообщению за раз), чат без токенов
+    откладывается и не задерживает остальных. Отправки ограничены общим ведром токенов
+    и ведром чата (личный чат / группа), на 429 чат ждёт retry_after и сообщение повторяется.
+    При shared_limits вёдра хранятся в Redis и общие для всех процессов доставки,
+    при ошибке Redis используются вёдра в памяти процесса.
+    Временные ошибки повторяются с экспоненциальной задержкой, после max_retries попыток
+    сообщение попадает в dead-letter очередь в Redis
+    """
+
+    def __init__(self, partitions: int = 16, maxsize: int = 1000, global_rate: float = 30,
+                 private_rate: float = 1, group_rate: float = 20 / 60, max_retries: int = 5,
+                 retry_base_delay: float = 1, retry_max_delay: float = 60, shared_limits: bool = True):
+        self.partitions_count = partitions
+        self.maxsize = maxsize
+        self.global_rate = global_rate
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.shared_limits = shared_limits
+        self.partitions = []
+        self.workers = []
+        self.chats = {}    # chat_id -> deque[_Job]
+        self.buckets = {}  # chat_id -> TokenBucket (вёдра в памяти процесса)
+        self.buckets_swept = time.monotonic()
+        self.parked = {}   # chat_id -> TimerHandle
+        self.global_bucket = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self.workers)
+
+    async def start(self):
+        """
+        Запуск воркера для каждой партиции
+        """
+
+        if self.workers:
+            return
+
+        self.global_bucket = TokenBucket(self.global_rate, self.global_rate)
+        self.partitions = [_Partition(self.maxsize) for _ in range(self.partitions_count)]
+        self.workers = [
+            asyncio.create_task(self._worker(i))
+            for i in range(self.partitions_count)
+        ]
+        logger.info(f"Delivery dispatcher started (partitions: {self.partitions_count}, "
+                    f"global rate: {self.global_rate}/s, "
+                    f"limits: {'shared' if self.shared_limits else 'per process'})")
+
+    async def stop(self, timeout: float = 10):
+        """
+        Остановка воркеров с попыткой доставить накопленные сообщения
+        """
+
+        if not self.workers:
+            return
+
+        deadline = time.monotonic() + timeout
+        while self.chats and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.chats:
+            pending = sum(len(jobs) for jobs in self.chats.values())
+            logger.warning(f"Delivery dispatcher stopped with {pending} undelivered notifications")
+
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+        # ожидающие рассылки не должны зависнуть
+        for handle in self.parked.values():
+            handle.cancel()
+        self.parked.clear()
+        for jobs in self.chats.values():
+            for job in jobs:
+                job.future.cancel()
+        self.chats.clear()
+        for number in range(self.partitions_count):
+            DELIVERY_QUEUE_DEPTH.set(0, str(number))
+        DELIVERY_PARKED_CHATS.set(0)
+        logger.info("Delivery dispatcher stopped")
+
+    def partition(self, chat_id: int) -> int:
+        """
+        Номер партиции чата
+        """
+
+        return hash(chat_id) % self.partitions_count
+
+    async def submit(self, chat_id: int, func, dead_letter: dict = None, skip=None) -> asyncio.Future:
+        """
+        Поставить отправку в очередь чата. func - корутинная функция без аргументов,
+        dead_letter - что сохранить в dead-letter очередь, если попытки закончатся,
+        skip - функция без аргументов, которая перед отправкой возвращает готовый результат,
+        если отправка не нужна (такое сообщение не расходует лимиты Telegram).
+        Возвращает future с результатом func; ждёт, если очередь партиции заполнена
+        """
+
+        number = self.partition(chat_id)
+        partition = self.partitions[number]
+        await partition.slots.acquire()
+
+        future = asyncio.get_running_loop().create_future()
+        jobs = self.chats.get(chat_id)
+        if jobs is None:
+            jobs = self.chats[chat_id] = deque()
+            partition.ready.put_nowait(chat_id)
+        jobs.append(_Job(func, future, dead_letter, skip))
+
+        partition.pending += 1
+        DELIVERY_QUEUE_DEPTH.set(partition.pending, str(number))
+        return future
+
+    def _chat_limits(self, chat_id: int) -> tuple[float, float]:
+        """
+        (скорость, ёмкость) ведра чата. Отрицательные ID - группы и каналы
+        """
+
+        if chat_id < 0:
+            return self.group_rate, 3
+        return self.private_rate, 1
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            self._sweep_buckets()
+            bucket = self.buckets[chat_id] = TokenBucket(*self._chat_limits(chat_id))
+        return bucket
+
+    def _sweep_buckets(self):
+        """
+        Удалить наполнившиеся вёдра чатов без сообщений в очереди
+        """
+
+        now = time.monotonic()
+        if now - self.buckets_swept < BUCKET_SWEEP_INTERVAL:
+            return
+        self.buckets_swept = now
+        idle = [chat_id for chat_id, bucket in self.buckets.items()
+                if chat_id not in self.chats and bucket.is_full()]
+        for chat_id in idle:
+            del self.buckets[chat_id]
+
+    async def _take_token(self, chat_id: int) -> tuple[str, float]:
+        """
+        Взять токен общего ведра и ведра чата: ('', 0) - можно отправлять,
+        ('chat' / 'global', секунд до токена) - в каком ведре не хватило токена
+        """
+
+        if self.shared_limits:
+            try:
+                return await asyncio.to_thread(
+                    storage.take_send_token, chat_id, *self._chat_limits(chat_id),
+                    self.global_rate, self.global_rate
+                )
+            except redis.RedisError as e:
+                logger.warning(f"Failed to take send token from Redis, using local limits: {e}")
+
+        bucket = self._chat_bucket(chat_id)
+        delay = bucket.delay()
+        if delay:
+            return "chat", delay
+        delay = self.global_bucket.delay()
+        if delay:
+            return "global", delay
+        bucket.consume()
+        self.global_bucket.consume()
+        return "", 0
+
+    def _park(self, number: int, chat_id: int, delay: float):
+        """
+        Отложить чат на delay секунд, не занимая воркер
+        """
+
+        def unpark():
+            self.parked.pop(chat_id, None)
+            DELIVERY_PARKED_CHATS.set(len(self.parked))
+            self.partitions[number].ready.put_nowait(chat_id)
+
+        self.parked[chat_id] = asyncio.get_running_loop().call_later(delay, unpark)
+        DELIVERY_PARKED_CHATS.set(len(self.parked))
+
+    def _retry_delay(self, attempt: int) -> float:
+        """
+        Экспоненциальная задержка со случайной составляющей (от половины до полной)
+        """
+
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _dead_letter(self, chat_id: int, job: _Job, error: Exception):
+        """
+        Сохранить сообщение, исчерпавшее попытки, в dead-letter очередь
+        """
+
+        entry = dict(job.dead_letter, chat_id=chat_id, error=f"{type(error).__name__}: {error}",
+                     attempts=job.attempts + 1, failed_at=int(time.time()))
+        try:
+            await asyncio.to_thread(storage.push_dead_letter, entry, Config.DEAD_LETTER_MAXLEN)
+            DEAD_LETTERS_TOTAL.inc()
+            logger.error(f"Notification to chat {chat_id} moved to dead-letter queue after "
+                         f"{job.attempts + 1} attempts: {entry['error']}")
+        except redis.RedisError as e:
+            logger.error(f"Failed to save dead letter for chat {chat_id}: {e}")
+
+    async def _worker(self, number: int):
+        """
+        Воркер партиции: по одному сообщению от каждого готового чата по кругу
+        """
+
+        partition = self.partitions[number]
+        label = str(number)
+        while True:
+            chat_id = await partition.ready.get()
+            jobs = self.chats[chat_id]
+            job = jobs[0]
+            future = job.future
+
+            # проверка до токенов: ненужная отправка не расходует лимиты
+            skipped = job.skip() if job.skip and not future.done() else None
+            if skipped is not None:
+                future.set_result(skipped)
+            elif not future.done():
+                # общий лимит ждёт воркер, лимит чата - только сам чат
+                scope, delay = await self._take_token(chat_id)
+                while scope == "global":
+                    await asyncio.sleep(delay)
+                    scope, delay = await self._take_token(chat_id)
+                if scope:
+                    self._park(number, chat_id, delay)
+                    continue
+
+            try:
+                if not future.done():
+                    result = await job.func()
+                    if not future.done():
+                        future.set_result(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 429: сообщение остаётся первым в очереди чата и повторяется после паузы
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is not None and not future.done():
+                    SEND_FAILURES_TOTAL.inc("RetryAfter")
+                    logger.warning(f"Flood control for chat {chat_id}: retry in {retry_after}s")
+                    self._park(number, chat_id, retry_after)
+                    continue
+
+                # временная ошибка: повтор с задержкой, остальные чаты партиции не ждут
+                if isinstance(e, TRANSIENT_ERRORS) and job.attempts < self.max_retries and not future.done():
+                    delay = self._retry_delay(job.attempts)
+                    job.attempts += 1
+                    SEND_FAILURES_TOTAL.inc(type(e).__name__)
+                    logger.warning(f"Send to chat {chat_id} failed ({type(e).__name__}: {e}), "
+                                   f"retry {job.attempts}/{self.max_retries} in {delay:.1f}s")
+                    self._park(number, chat_id, delay)
+                    continue
+
+                if isinstance(e, TRANSIENT_ERRORS) and job.dead_letter:
+                    await self._dead_letter(chat_id, job, e)
+                if not future.done():
+                    future.set_exception(e)
+
+            jobs.popleft()
+            partition.pending -= 1
+            partition.slots.release()
+            DELIVERY_QUEUE_DEPTH.set(partition.pending, label)
+
+            if jobs:
+                # в конец круга, чтобы не задерживать другие чаты партиции
+                partition.ready.put_nowait(chat_id)
+            else:
+                del self.chats[chat_id]
+
+
+dispatcher = PartitionedDispatcher(
+    Config.DELIVERY_PARTITIONS,
+    Config.DELIVERY_PARTITION_QUEUE_SIZE,
+    global_rate=Config.TELEGRAM_GLOBAL_RATE,
+    private_rate=Config.TELEGRAM_PRIVATE_CHAT_RATE,
+    group_rate=Config.TELEGRAM_GROUP_CHAT_RATE / 60,
+    max_retries=Config.DELIVERY_MAX_RETRIES,
+    retry_base_delay=Config.DELIVERY_RETRY_BASE_DELAY,
+    retry_max_delay=Config.DELIVERY_RETRY_MAX_DELAY,
+    shared_limits=Config.TELEGRAM_RATE_LIMITS == "redis"
+)
+
+
+def text_hash(text: str) -> str:
+    """
+    Короткий хэш текста сообщения для пропуска редактирований без изменений
+    """
+
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+class EventMessages:
+    """
+    Сообщения события во всех чатах (event_key -> {chat_id: (message_id, хэш текста)}).
+    Читается одним HGETALL на рассылку и записывается одной пачкой после неё.
+    Недавние отправки процесса хранятся и в памяти: следующее событие в том же чате
+    может начаться до записи пачки в Redis. Память используется, только пока в Redis
+    записи нет: сообщение могли отредактировать другие процессы
+    """
+
+    def __init__(self, ttl: int = 86400, lru_size: int = 1000):
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self.recent = OrderedDict()  # event_key -> {chat_id: (message_id, хэш текста)}
+        self.saving = set()  # фоновые записи в Redis, запущенные по завершении рассылок
+
+    async def load(self, event_key: str) -> dict:
+        """
+        Сообщения события из Redis (при ошибке Redis - пустой словарь)
+        """
+
+        try:
+            return await asyncio.to_thread(storage.get_event_messages, event_key)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to load messages of {event_key}: {e}")
+            return {}
+
+    def lookup(self, event_key: str, chat_id: int, loaded: dict) -> Optional[tuple]:
+        """
+        (message_id, хэш текста) сообщения события в чате: загруженное из Redis,
+        а если там ещё нет записи - недавняя отправка процесса
+        """
+
+        if chat_id in loaded:
+            return loaded[chat_id]
+        recent = self.recent.get(event_key)
+        if recent:
+            return recent.get(chat_id)
+        return None
+
+    def remember(self, event_key: str, chat_id: int, message_id: int, digest: str = None):
+        """
+        Запомнить отправленное или отредактированное сообщение в памяти процесса
+        """
+
+        self.recent.setdefault(event_key, {})[chat_id] = (message_id, digest)
+        self.recent.move_to_end(event_key)
+        while len(self.recent) > self.lru_size:
+            self.recent.popitem(last=False)
+
+    async def save(self, event_key: str, messages: dict):
+        """
+        Записать новые и изменённые сообщения события в Redis одной пачкой
+        """
+
+        try:
+            await asyncio.to_thread(storage.save_event_messages, event_key, messages, self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to save {len(messages)} messages of {event_key}: {e}")
+
+    def save_later(self, event_key: str, messages: dict):
+        """
+        Запустить запись в фоне (из колбэка завершения рассылки)
+        """
+
+        task = asyncio.get_running_loop().create_task(self.save(event_key, messages))
+        self.saving.add(task)
+        task.add_done_callback(self.saving.discard)
+
+    async def flush(self):
+        """
+        Дождаться фоновых записей (при остановке, после остановки dispatcher)
+        """
+
+        if self.saving:
+            await asyncio.gather(*self.saving, return_exceptions=True)
+
+
+event_messages = EventMessages(Config.EVENT_MESSAGES_TTL)
+
+
+async def fan_out(notification_func, chat_ids, text: str, event_key: str = None,
+                  edit_existing: bool = False, filtered: int = 0, description: str = "",
+                  dead_letter: bool = True) -> asyncio.Future:
+    """
+    Рассылка уведомления по чатам. Если запущен dispatcher, отправки только ставятся в очереди
+    чатов (порядок сообщений в чате сохраняется), и функция сразу возвращается: паузы лимитов
+    и повторы ждут партиции, а не обработчик события. Иначе отправки идут параллельно,
+    не более FANOUT_CONCURRENCY, и функция ждёт их завершения.
+    Ошибка в одном чате не влияет на остальные. Возвращает future со статистикой рассылки;
+    когда она завершается, ID сообщений записываются в Redis, а итог - в лог одной строкой.
+    dead_letter=False - не сохранять сообщения, исчерпавшие попытки, в dead-letter очередь
+    """
+
+    stats = {SENT: 0, EDITED: 0, UNCHANGED: 0, FAILED: 0, GONE: 0, "filtered": filtered}
+    summary = asyncio.get_running_loop().create_future()
+
+    if not notification_func:
+        logger.error("❌ send_notification_func is not set!")
+        summary.set_result(stats)
+        return summary
+
+    chat_ids = list(chat_ids)
+
+    # ID уже отправленных сообщений события - один запрос на всю рассылку
+    loaded = await event_messages.load(event_key) if edit_existing and event_key else {}
+    digest = text_hash(text) if event_key else None
+    new_messages = {}
+
+    def previous(chat_id: int) -> tuple:
+        return event_messages.lookup(event_key, chat_id, loaded) or (None, None)
+
+    def unchanged(chat_id: int) -> Optional[DeliveryResult]:
+        # тот же текст уже в чате - запрос к Telegram не нужен
+        message_id, last_digest = previous(chat_id)
+        if message_id and last_digest == digest:
+            return DeliveryResult(UNCHANGED, message_id)
+        return None
+
+    async def send(chat_id: int):
+        message_id = None
+        if edit_existing and event_key:
+            skipped = unchanged(chat_id)
+            if skipped:
+                return skipped
+            message_id, _ = previous(chat_id)
+
+        with STAGE_DURATION.time("telegram_send"):
+            result = await notification_func(
+                chat_id=chat_id,
+                text=text,
+                event_key=event_key,
+                edit_existing=edit_existing,
+                message_id=message_id
+            )
+        if (event_key and isinstance(result, DeliveryResult) and result.message_id
+                and result.status in (SENT, EDITED, UNCHANGED)):
+            # после миграции группы сообщение находится уже в супергруппе
+            target = result.chat_id or chat_id
+            event_messages.remember(event_key, target, result.message_id, digest)
+            new_messages[target] = (result.message_id, digest)
+        return result
+
+    def finish(outcomes: asyncio.Future):
+        # вызывается после последней отправки рассылки
+        if outcomes.cancelled():
+            summary.cancel()
+            return
+
+        failed_chats = []
+        for chat_id, result in zip(chat_ids, outcomes.result()):
+            if isinstance(result, BaseException):
+                SEND_FAILURES_TOTAL.inc(type(result).__name__)
+                logger.debug(f"Failed to send notification to {chat_id}", exc_info=result)
+                failed_chats.append((chat_id, f"{type(result).__name__}: {result}"))
+                stats[FAILED] += 1
+                continue
+
+            status = result.status if isinstance(result, DeliveryResult) else SENT
+            stats[status] = stats.get(status, 0) + 1
+
+        if new_messages:
+            event_messages.save_later(event_key, new_messages)
+
+        line = (f"Delivered {description or event_key}: sent={stats[SENT]} edited={stats[EDITED]} "
+                f"unchanged={stats[UNCHANGED]} failed={stats[FAILED]} gone={stats[GONE]} "
+                f"filtered={stats['filtered']}")
+        if failed_chats:
+            errors = "; ".join(f"{chat_id}: {error}" for chat_id, error in failed_chats[:10])
+            logger.warning(f"{line} errors=[{errors}]")
+        else:
+            logger.info(line)
+
+        summary.set_result(stats)
+
+    if dispatcher.running:
+        # только постановка в очереди по порядку: результаты обрабатывает finish
+        entry = {"text": text, "event_key": event_key, "edit_existing": edit_existing,
+                 "description": description} if dead_letter else None
+        # сообщение без изменений отсеивается до того, как чат возьмёт токены
+        check_unchanged = edit_existing and event_key
+        futures = [
+            await dispatcher.submit(chat_id, partial(send, chat_id), entry,
+                                    skip=partial(unchanged, chat_id) if check_unchanged else None)
+            for chat_id in chat_ids
+        ]
+        asyncio.gather(*futures, return_exceptions=True).add_done_callback(finish)
+    else:
+        semaphore = asyncio.Semaphore(Config.FANOUT_CONCURRENCY)
+
+        async def deliver(chat_id: int):
+            async with semaphore:
+                return await send(chat_id)
+
+        outcomes = asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids),
+                                  return_exceptions=True)
+        outcomes.add_done_callback(finish)
+        await outcomes
+
+    return summary
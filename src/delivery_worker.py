@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import sys
+
+from bot import bot, send_notification
+from coalescing import coalescer
+from config import Config
+from delivery import dispatcher, event_messages
+from grouping import group_buffer
+from quotas import quota_limiter
+from subscriptions_cache import subscribed_repos
+from webhook_server import create_event_queue
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    """
+    Отдельный процесс доставки: читает события из Redis Streams и отправляет уведомления
+    """
+
+    if Config.WEBHOOK_PROCESSING != "stream":
+        logger.error("Delivery worker requires WEBHOOK_PROCESSING=stream")
+        return
+
+    # множество подписок и сброс индекса маршрутизации при изменении фильтров
+    await subscribed_repos.start()
+    await dispatcher.start()
+    await quota_limiter.start(send_notification)
+    await group_buffer.start(send_notification)
+
+    workers = max(Config.WEBHOOK_WORKERS, 1)
+    event_queue = create_event_queue(notification_func=send_notification, workers=workers)
+    await event_queue.start()
+
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        logger.info("Shutting down delivery worker...")
+        await event_queue.stop()
+        await coalescer.stop()
+        await quota_limiter.stop()
+        await group_buffer.stop()
+        await dispatcher.stop()
+        await event_messages.flush()
+        await subscribed_repos.stop()
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+
+import redis
+
+from config import Config
+from github_api import github_api
+from redis_storage import storage
+
+logger = logging.getLogger(__name__)
+
+
+async def enrich_pr_commits(payload: dict):
+    """
+    Добавить в payload pull_request список коммитов (commits_list).
+    Запрос к GitHub выполняется в потоке, результат кэшируется по head.sha
+    """
+
+    try:
+        pr = payload.get("pull_request", {})
+        pr_number = pr.get("number")
+        head_sha = pr.get("head", {}).get("sha")
+        full_name = payload.get("repository", {}).get("full_name", "")
+
+        if not pr_number or not full_name or "/" not in full_name:
+            return
+
+        commits = None
+        if head_sha:
+            try:
+                commits = storage.get_cached_pr_commits(full_name, pr_number, head_sha)
+            except redis.RedisError as e:
+                logger.warning(f"Failed to read PR commits cache: {e}")
+
+        if commits is None:
+            owner, repo_name = full_name.split("/", 1)
+            commits = await asyncio.to_thread(github_api.get_pr_commits, owner, repo_name, pr_number)
+            if commits and head_sha:
+                try:
+                    storage.cache_pr_commits(full_name, pr_number, head_sha, commits,
+                                             ttl=Config.PR_COMMITS_CACHE_TTL)
+                except redis.RedisError as e:
+                    logger.warning(f"Failed to cache PR commits: {e}")
+
+        if commits:
+            payload["pull_request"]["commits_list"] = commits
+            logger.info(f"Enriched PR #{pr_number} with {len(commits)} commits")
+    except Exception as e:
+        logger.warning(f"Failed to enrich PR with commits: {e}")
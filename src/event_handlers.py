@@ -394,11 +394,27 @@ def get_event_handler(event_type: str):
         "pull_request": format_pull_request_event,
         "pull_request_review_comment": format_pr_review_comment_event,
         "workflow_run": format_workflow_run_event,
+        "create": format_create_event,
         "CreateEvent": format_create_event
     }
     return handlers.get(event_type)
 
 
+def get_event_key(event_type: str, payload: dict) -> Optional[str]:
+    """
+    Ключ редактируемого сообщения события без форматирования текста
+    (совпадает с event_key, который возвращает обработчик)
+    """
+
+    repo_name = payload.get("repository", {}).get("full_name", "Unknown")
+
+    if event_type == "workflow_run":
+        return f"workflow:{repo_name}:{payload.get('workflow_run', {}).get('id')}"
+    if event_type == "pull_request":
+        return f"pr:{repo_name}:{payload.get('pull_request', {}).get('number')}"
+    return None
+
+
 def get_author_from_event(event_type: str, payload: dict) -> Optional[str]:
     """
     Получить автора события
@@ -437,6 +453,7 @@ def get_event_type_for_filter(event_type: str) -> str:
         "pull_request": "pull_request",
         "pull_request_review_comment": "pull_request",
         "workflow_run": "workflow_run",
+        "create": "push",
 
         # Events API event types
         "PushEvent": "push",
@@ -450,3 +467,27 @@ def get_event_type_for_filter(event_type: str) -> str:
         "DeleteEvent": "push",  # Удаление ветки/тега
     }
     return mapping.get(event_type, event_type)
+
+
+def format_grouped_events(repo_name: str, texts: list) -> str:
+    """
+    Объединить отформатированные события одного репозитория в одно сообщение
+    """
+
+    grouped_text = f"📦 <b>{repo_name}</b>\n"
+    grouped_text += f"<i>Новые события ({len(texts)})</i>\n\n"
+
+    for text in texts:
+        # Убираем только первую строку с названием репозитория из каждого события
+        lines = text.split('\n')
+        # Ищем и удаляем строку с названием репозитория в начале (без форматирования)
+        if len(lines) > 1 and repo_name in lines[1]:
+            # Если вторая строка содержит только название репо (может быть с тегами)
+            if lines[1].strip() == repo_name or lines[1].strip() == f"<b>{repo_name}</b>":
+                lines.pop(1)
+        text = '\n'.join(lines)
+
+        grouped_text += f"{'─' * 30}\n"
+        grouped_text += text.strip() + "\n"
+
+    return grouped_text
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import redis
+
+from payload import loads, dumps
+
+logger = logging.getLogger(__name__)
+
+
+class EventQueue:
+    """
+    Ограниченная очередь событий в памяти процесса с пулом воркеров
+    """
+
+    def __init__(self, process_func, maxsize: int = 1000, workers: int = 4):
+        self.process_func = process_func  # async (event_type, payload, delivery_id)
+        self.maxsize = maxsize
+        self.workers_count = workers
+        self.queue = None
+        self.workers = []
+
+    async def start(self):
+        """
+        Запуск воркеров
+        """
+
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.workers = [
+            asyncio.create_task(self._worker(i))
+            for i in range(self.workers_count)
+        ]
+        logger.info(f"Event queue started (size: {self.maxsize}, workers: {self.workers_count})")
+
+    async def stop(self, timeout: float = 10):
+        """
+        Остановка воркеров с попыткой дообработать очередь
+        """
+
+        if self.queue is None:
+            return
+
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Event queue stopped with {self.queue.qsize()} unprocessed events")
+
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        logger.info("Event queue stopped")
+
+    def put(self, event_type: str, payload: dict, delivery_id: str = None,
+            raw: bytes = None) -> bool:
+        """
+        Поставить событие в очередь. Возвращает False, если очередь заполнена
+        """
+
+        try:
+            self.queue.put_nowait((event_type, payload, delivery_id))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _worker(self, number: int):
+        """
+        Воркер: забирает события из очереди и обрабатывает их
+        """
+
+        while True:
+            event_type, payload, delivery_id = await self.queue.get()
+            try:
+                await self.process_func(event_type, payload, delivery_id)
+            except Exception as e:
+                logger.error(f"Worker {number} failed to process delivery {delivery_id}: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+
+class RedisStreamQueue:
+    """
+    Надёжная очередь событий на Redis Streams с группой потребителей
+    """
+
+    def __init__(self, process_func, client, stream: str, group: str,
+                 workers: int = 4, maxlen: int = 10000, claim_idle_ms: int = 60000):
+        # async (event_type, payload, delivery_id, ack) -> True, если событие подтвердит ack
+        self.process_func = process_func
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.workers_count = workers
+        self.maxlen = maxlen
+        self.claim_idle_ms = claim_idle_ms
+        self.consumer_prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self.workers = []
+        # XREADGROUP блокирует поток до 5 секунд: отдельный пул, чтобы не занимать
+        # пул asyncio.to_thread, через который идут остальные вызовы Redis и хеширование
+        self.executor = None
+
+    async def start(self):
+        """
+        Создание группы потребителей и запуск воркеров
+        """
+
+        try:
+            self.client.xgroup_create(self.stream, self.group, id="$", mkstream=True)
+        except redis.ResponseError as e:
+            # группа уже существует
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        # без воркеров процесс только пишет события в stream, читают их процессы доставки
+        if self.workers_count > 0:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers_count,
+                thread_name_prefix="stream-reader"
+            )
+            self.workers = [
+                asyncio.create_task(self._worker(f"{self.consumer_prefix}-{i}"))
+                for i in range(self.workers_count)
+            ]
+        logger.info(f"Redis stream consumer started (stream: {self.stream}, group: {self.group}, "
+                    f"workers: {self.workers_count})")
+
+    async def stop(self, timeout: float = 10):
+        """
+        Остановка воркеров. Необработанные события остаются в stream
+        """
+
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.executor:
+            # незавершённые XREADGROUP вернутся сами по истечении block
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        logger.info("Redis stream consumer stopped")
+
+    def put(self, event_type: str, payload: dict, delivery_id: str = None,
+            raw: bytes = None) -> bool:
+        """
+        Записать событие в stream. Возвращает False при ошибке Redis.
+        raw - исходное тело запроса, чтобы не сериализовать payload повторно
+        """
+
+        fields = {
+            "event_type": event_type,
+            "delivery_id": delivery_id or "",
+            "payload": raw if raw is not None else dumps(payload)
+        }
+        try:
+            self.client.xadd(self.stream, fields, maxlen=self.maxlen, approximate=True)
+            return True
+        except redis.RedisError as e:
+            logger.error(f"Failed to add delivery {delivery_id} to stream: {e}")
+            return False
+
+    async def _worker(self, consumer: str):
+        """
+        Воркер: забирает зависшие события упавших потребителей, затем читает новые
+        """
+
+        last_claim = 0.0
+        while True:
+            try:
+                now = time.monotonic()
+                if now - last_claim >= self.claim_idle_ms / 1000:
+                    last_claim = now
+                    await self._claim_pending(consumer)
+
+                response = await self._run_blocking(
+                    self.client.xreadgroup,
+                    self.group, consumer, {self.stream: ">"},
+                    count=10, block=5000
+                )
+                for _, messages in response or []:
+                    for message_id, fields in messages:
+                        await self._process(message_id, fields)
+            except asyncio.CancelledError:
+                raise
+            except redis.RedisError as e:
+                logger.error(f"Stream consumer {consumer} Redis error: {e}")
+                await asyncio.sleep(1)
+
+    async def _claim_pending(self, consumer: str):
+        """
+        Перехватить события, которые слишком долго не подтверждены (XAUTOCLAIM)
+        """
+
+        start_id = "0-0"
+        while True:
+            response = await self._run_blocking(
+                self.client.xautoclaim,
+                self.stream, self.group, consumer,
+                self.claim_idle_ms, start_id, count=50
+            )
+            start_id, messages = response[0], response[1]
+            if messages:
+                logger.info(f"Consumer {consumer} claimed {len(messages)} pending events")
+            for message_id, fields in messages:
+                await self._process(message_id, fields)
+            if not messages or start_id in ("0-0", b"0-0"):
+                return
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """
+        Вызов Redis в собственном пуле потоков очереди
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def _process(self, message_id: str, fields: dict):
+        """
+        Обработать событие из stream и подтвердить его. Отложенное склейкой обновление
+        подтверждается позже, после его отправки
+        """
+
+        deferred = False
+        try:
+            # запись могла быть удалена обрезкой stream
+            if fields:
+                delivery_id = fields.get("delivery_id") or None
+                deferred = await self.process_func(
+                    fields["event_type"],
+                    loads(fields["payload"]),
+                    delivery_id,
+                    ack=partial(self._ack, message_id)
+                )
+        except Exception as e:
+            logger.error(f"Failed to process stream entry {message_id}: {e}", exc_info=True)
+        finally:
+            if not deferred:
+                await self._ack(message_id)
+
+    async def _ack(self, message_id: str):
+        """
+        Подтвердить обработку записи stream (XACK)
+        """
+
+        try:
+            await asyncio.to_thread(self.client.xack, self.stream, self.group, message_id)
+        except redis.RedisError as e:
+            logger.error(f"Failed to ack stream entry {message_id}: {e}")
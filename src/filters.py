@@ -0,0 +1,179 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+
+"""
+Расширенные фильтры подписок: ветки, пути, метки, workflow.
+Правила компилируются один раз в регулярные выражения и переиспользуются для всех событий
+"""
+
+# правила фильтров -> подпись в боте
+RULES = {
+    "branches": "Ветки",
+    "paths": "Пути",
+    "labels": "Метки",
+    "workflows": "Workflow",
+    "conclusions": "Результат workflow",
+}
+
+
+class EventAttributes(NamedTuple):
+    """
+    Поля события, по которым работают расширенные фильтры.
+    None - у события нет такого поля, правило к нему не применяется.
+    branch="" - событие относится не к ветке (тег), правило веток его отсеивает;
+    paths=() - событие не меняет файлов, правило путей его отсеивает
+    """
+
+    branch: Optional[str] = None
+    paths: Optional[tuple] = None
+    labels: Optional[frozenset] = None
+    workflow: Optional[str] = None
+    conclusion: Optional[str] = None
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Перевод glob-шаблона в регулярное выражение:
+    * - любые символы кроме /, ** - любые символы, ? - один символ кроме /
+    """
+
+    result = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            # services/**/api.py совпадает и с services/api.py
+            result.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            result.append(".*")
+            i += 2
+            continue
+        if char == "*":
+            result.append("[^/]*")
+        elif char == "?":
+            result.append("[^/]")
+        else:
+            result.append(re.escape(char))
+        i += 1
+    return "".join(result)
+
+
+@lru_cache(maxsize=1024)
+def compile_globs(patterns: tuple):
+    """
+    Объединить шаблоны в одно регулярное выражение.
+    Одинаковые наборы шаблонов у разных чатов компилируются один раз
+    """
+
+    return re.compile("|".join(f"(?:{glob_to_regex(p)})" for p in patterns))
+
+
+class CompiledFilter:
+    """
+    Скомпилированные расширенные правила одной подписки
+    """
+
+    __slots__ = ("branches", "paths", "labels", "workflows", "conclusions")
+
+    def __init__(self, filters: dict):
+        self.branches = self._globs(filters.get("branches"))
+        self.paths = self._globs(filters.get("paths"))
+        self.workflows = self._globs(filters.get("workflows"))
+        self.labels = frozenset(filters.get("labels") or ()) or None
+        self.conclusions = frozenset(c.lower() for c in filters.get("conclusions") or ()) or None
+
+    @staticmethod
+    def _globs(patterns: list):
+        return compile_globs(tuple(sorted(patterns))) if patterns else None
+
+    def matches(self, attrs: EventAttributes) -> bool:
+        """
+        Проверка события. Правило, поля которого нет у события, пропускает его
+        """
+
+        if self.branches and attrs.branch is not None:
+            if not attrs.branch or not self.branches.fullmatch(attrs.branch):
+                return False
+
+        if self.paths and attrs.paths is not None:
+            fullmatch = self.paths.fullmatch
+            if not any(fullmatch(path) for path in attrs.paths):
+                return False
+
+        if self.labels and attrs.labels is not None:
+            if self.labels.isdisjoint(attrs.labels):
+                return False
+
+        if self.workflows and attrs.workflow is not None:
+            if not self.workflows.fullmatch(attrs.workflow):
+                return False
+
+        if self.conclusions and attrs.workflow is not None:
+            if (attrs.conclusion or "") not in self.conclusions:
+                return False
+
+        return True
+
+
+def compile_filter(filters: dict = None) -> Optional[CompiledFilter]:
+    """
+    Скомпилировать расширенные правила подписки (None, если их нет)
+    """
+
+    if not filters or not any(filters.get(rule) for rule in RULES):
+        return None
+    return CompiledFilter(filters)
+
+
+def parse_patterns(text: str) -> list:
+    """
+    Разбор шаблонов, введённых в боте через запятую или с новой строки
+    """
+
+    return [p.strip() for p in re.split(r"[,\n]", text) if p.strip()]
+
+
+def extract_attributes(event_type: str, payload: dict) -> EventAttributes:
+    """
+    Достать ветку, пути, метки и workflow события (webhook и Events API)
+    """
+
+    branch = None
+    paths = None
+    labels = None
+    workflow = None
+    conclusion = None
+
+    if event_type in ("push", "PushEvent"):
+        ref = payload.get("ref") or ""
+        # push тега не является push в ветку
+        branch = ref[len("refs/heads/"):] if ref.startswith("refs/heads/") else ""
+        # Events API не передаёт списки файлов: правило путей к таким событиям не применяется.
+        # У вебхука списки есть всегда, пустой список (удаление ветки, тег) правило путей не проходит
+        if event_type == "push":
+            changed = []
+            for commit in payload.get("commits") or []:
+                for key in ("added", "modified", "removed"):
+                    changed.extend(commit.get(key) or ())
+            paths = tuple(changed)
+
+    elif event_type in ("CreateEvent", "create"):
+        branch = payload.get("ref") if payload.get("ref_type") == "branch" else ""
+
+    elif event_type in ("workflow_run", "WorkflowRunEvent"):
+        run = payload.get("workflow_run") or {}
+        branch = run.get("head_branch")
+        workflow = run.get("name") or (payload.get("workflow") or {}).get("name") or ""
+        conclusion = run.get("conclusion")
+
+    item = payload.get("pull_request") or payload.get("issue")
+    if item:
+        labels = frozenset(label.get("name") for label in item.get("labels") or ())
+        if "base" in item:
+            branch = (item.get("base") or {}).get("ref")
+
+    return EventAttributes(branch, paths, labels, workflow, conclusion)
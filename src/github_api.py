@@ -1,4 +1,5 @@
 import re
+from itertools import islice
 from typing import Optional, Tuple
 from github import Github, GithubException
 
@@ -102,21 +103,19 @@ class GitHubAPI:
             "private": repo.private
         }
 
-    def get_pr_commits(self, owner: str, repo_name: str, pr_number: int) -> list:
+    def get_pr_commits(self, owner: str, repo_name: str, pr_number: int, limit: int = 10) -> list:
         """
-        Получить список коммитов из Pull Request
+        Получить список первых коммитов из Pull Request (загружается только первая страница)
         """
 
-        repo = self.get_repo(owner, repo_name)
-        if not repo:
-            return []
-
         try:
+            # lazy - без отдельного запроса за самим репозиторием
+            repo = self.client.get_repo(f"{owner}/{repo_name}", lazy=True)
             pr = repo.get_pull(pr_number)
             commits = []
 
             # Ограничиваем до 10 коммитов для избежания перегрузки
-            for commit in list(pr.get_commits())[:10]:
+            for commit in islice(pr.get_commits(), limit):
                 commits.append({
                     "sha": commit.sha,
                     "message": commit.commit.message,
@@ -1,10 +1,14 @@
 import asyncio
 import logging
-from typing import Set
+from typing import NamedTuple, Set
 from github import GithubException
 
+from delivery import fan_out
+from filters import EventAttributes, extract_attributes
 from github_api import github_api
+from quotas import quota_limiter
 from redis_storage import storage
+from routing import Resolution, routing_index
 from event_handlers import (
     format_push_event,
     format_issues_event,
@@ -13,6 +17,7 @@ from event_handlers import (
     format_pr_review_comment_event,
     format_workflow_run_event,
     format_create_event,
+    format_grouped_events,
     get_event_type_for_filter,
     get_author_from_event
 )
@@ -20,6 +25,21 @@ from event_handlers import (
 logger = logging.getLogger(__name__)
 
 
+class RenderedEvent(NamedTuple):
+    """
+    Отформатированное событие Events API и его получатели
+    """
+
+    event_type: str
+    text: str
+    event_key: str
+    recipients: set
+    filter_event_type: str
+    author: str
+    quotas: dict   # квоты получателей
+    grouped: set   # получатели с группировкой событий
+
+
 class GitHubPoller:
     """
     Опрос GitHub API для получения новых событий
@@ -67,17 +87,11 @@ class GitHubPoller:
 
     def _get_all_subscribed_repos(self) -> Set[str]:
         """Получить все репозитории, на которые есть подписки"""
-        repos = set()
-        # Это нужно реализовать в storage - получение всех repo_url
-        # Пока используем хак через сканирование ключей
         try:
-            for key in storage.client.scan_iter("repo_chats:*"):
-                repo_url = key.replace("repo_chats:", "")
-                repos.add(repo_url)
+            return storage.get_subscribed_repos()
         except Exception as e:
             logger.error(f"Error getting subscribed repos: {e}")
-
-        return repos
+            return set()
 
     async def poll_repo(self, repo_url: str):
         """Опрос одного репозитория"""
@@ -118,7 +132,7 @@ class GitHubPoller:
             logger.info(f"Found {len(new_events)} new events for {repo_url}")
 
             # Получаем подписанные чаты
-            chat_ids = storage.get_chats_for_repo(repo_url)
+            chat_ids = routing_index.get_chats(repo_url)
 
             if not chat_ids:
                 logger.warning(f"⚠️ No subscribed chats for {repo_url}")
@@ -127,17 +141,30 @@ class GitHubPoller:
                     storage.set_last_event_id(repo_url, new_events[-1].id)
                 return
 
-            # Группируем события по чатам с учетом настроек группировки
-            for chat_id in chat_ids:
-                group_events = storage.get_group_events(chat_id, repo_url)
-
-                if group_events:
-                    # Отправляем все события одним сообщением
-                    await self.send_grouped_events(chat_id, repo_url, new_events)
-                else:
-                    # Отправляем каждое событие отдельно
-                    for event in new_events:
-                        await self.process_event(repo_url, event, chat_id)
+            # Каждое событие нормализуется и форматируется один раз за цикл опроса
+            rendered = self.render_events(repo_url, new_events)
+
+            # Отдельные сообщения: текст события рассылается всем негруппирующим получателям
+            for item in rendered:
+                recipients = item.recipients - item.grouped
+                # события сверх квоты чата уходят в сводку
+                if recipients and item.quotas:
+                    recipients, _ = await quota_limiter.apply(
+                        repo_url, recipients, item.quotas, item.filter_event_type, item.author
+                    )
+                if recipients:
+                    await fan_out(
+                        self.notification_func,
+                        recipients,
+                        item.text,
+                        event_key=item.event_key,
+                        edit_existing=False,
+                        description=f"polled {item.event_type} for {repo_url}"
+                    )
+
+            # Чаты с группировкой получают все свои события одним сообщением
+            grouped = set().union(*(item.grouped for item in rendered))
+            await self.send_grouped_events(repo_url, rendered, grouped)
 
             # Сохраняем ID последнего обработанного события
             if new_events:
@@ -148,9 +175,20 @@ class GitHubPoller:
         except Exception as e:
             logger.error(f"Error polling {repo_url}: {e}", exc_info=True)
 
-    async def process_event(self, repo_url: str, event, chat_id: int):
-        """Обработка одного события для конкретного чата"""
-        event_type = event.type
+    def _get_recipients(self, repo_url: str, filter_event_type: str, author: str,
+                        attrs: EventAttributes = None, cache: dict = None) -> Resolution:
+        """Чаты, фильтры которых пропускают событие (с кэшем на цикл опроса)"""
+        cache_key = (filter_event_type, author, attrs)
+        if cache is not None and cache_key in cache:
+            return cache[cache_key]
+
+        route = routing_index.resolve(repo_url, filter_event_type, author, attrs)
+        if cache is not None:
+            cache[cache_key] = route
+        return route
+
+    def _prepare_payload(self, repo_url: str, event) -> dict:
+        """Дополнение payload события Events API полями webhook-формата"""
         payload = event.payload
 
         # Добавляем информацию о репозитории в payload
@@ -165,134 +203,71 @@ class GitHubPoller:
         # Добавляем sender и actor (для совместимости)
         if event.actor:
             if "sender" not in payload:
-                payload["sender"] = {
-                    "login": event.actor.login
-                }
+                payload["sender"] = {"login": event.actor.login}
             if "actor" not in payload:
-                payload["actor"] = {
-                    "login": event.actor.login
-                }
-
-        # Получаем автора и тип для фильтрации
-        author = get_author_from_event(event_type, payload)
-        filter_event_type = get_event_type_for_filter(event_type)
-
-        # Проверяем фильтры
-        filters = storage.get_filters(chat_id, repo_url)
-
-        if filters:
-            # Проверка типа события
-            event_types = filters.get("event_types", [])
-            if event_types and filter_event_type not in event_types:
-                logger.debug(f"Event type {filter_event_type} filtered out for chat {chat_id}")
-                return
+                payload["actor"] = {"login": event.actor.login}
 
-            # Проверка автора
-            excluded_authors = filters.get("excluded_authors", [])
-            if author and author in excluded_authors:
-                logger.debug(f"Author {author} filtered out for chat {chat_id}")
-                return
-
-        # Форматируем событие
-        text, event_key = self.format_event(event_type, payload)
+        return payload
 
-        if not text:
-            logger.warning(f"⚠️ No handler or empty text for event type: {event_type}")
-            return
-
-        # Отправляем уведомление
-        if self.notification_func:
-            try:
-                await self.notification_func(
-                    chat_id=chat_id,
-                    text=text,
-                    event_key=event_key,
-                    edit_existing=False
-                )
-                logger.info(f"✅ Notification sent to chat {chat_id}")
-            except Exception as e:
-                logger.error(f"❌ Failed to send notification to {chat_id}: {e}", exc_info=True)
-
-    async def send_grouped_events(self, chat_id: int, repo_url: str, events: list):
-        """Отправка группы событий одним сообщением"""
-        if not events:
-            return
-
-        filtered_events = []
+    def render_events(self, repo_url: str, events: list) -> list:
+        """Форматирование новых событий репозитория (по одному разу на событие)"""
+        # Получатели вычисляются один раз на (тип события, автор, поля правил) за цикл опроса
+        recipients_cache = {}
+        rendered = []
 
         for event in events:
             event_type = event.type
-            payload = event.payload
-
-            # Добавляем информацию о репозитории
-            if "repository" not in payload:
-                # event.repo.name содержит полное имя "owner/repo"
-                full_name = event.repo.name if '/' in event.repo.name else repo_url.replace("https://github.com/", "")
-                payload["repository"] = {
-                    "html_url": repo_url,
-                    "full_name": full_name
-                }
-
-            # Добавляем sender/actor
-            if event.actor:
-                if "sender" not in payload:
-                    payload["sender"] = {"login": event.actor.login}
-                if "actor" not in payload:
-                    payload["actor"] = {"login": event.actor.login}
-
-            # Проверяем фильтры
+            payload = self._prepare_payload(repo_url, event)
+
+            # Получаем автора и тип для фильтрации
             author = get_author_from_event(event_type, payload)
             filter_event_type = get_event_type_for_filter(event_type)
 
-            filters = storage.get_filters(chat_id, repo_url)
-            if filters:
-                event_types = filters.get("event_types", [])
-                if event_types and filter_event_type not in event_types:
-                    continue
+            attrs = extract_attributes(event_type, payload)
 
-                excluded_authors = filters.get("excluded_authors", [])
-                if author and author in excluded_authors:
-                    continue
+            route = self._get_recipients(repo_url, filter_event_type, author, attrs, recipients_cache)
+            if not route.recipients:
+                logger.debug(f"Event {filter_event_type} by {author} filtered out for all chats")
+                continue
 
             # Форматируем событие
-            text, _ = self.format_event(event_type, payload)
-            if text:
-                filtered_events.append((event_type, text))
+            text, event_key = self.format_event(event_type, payload)
+            if not text:
+                logger.warning(f"⚠️ No handler or empty text for event type: {event_type}")
+                continue
+
+            rendered.append(RenderedEvent(event_type, text, event_key, route.recipients,
+                                          filter_event_type, author, route.quotas, route.grouped))
+
+        return rendered
 
-        if not filtered_events:
-            logger.info(f"No events passed filters for chat {chat_id}")
+    async def send_grouped_events(self, repo_url: str, rendered: list, chat_ids: set):
+        """Отправка событий одним сообщением в чаты с группировкой"""
+        if not rendered or not chat_ids:
             return
 
-        # Формируем сгруппированное сообщение
         repo_name = repo_url.replace("https://github.com/", "")
-        grouped_text = f"📦 <b>{repo_name}</b>\n"
-        grouped_text += f"<i>Новые события ({len(filtered_events)})</i>\n\n"
-
-        for i, (event_type, text) in enumerate(filtered_events, 1):
-            # Убираем только первую строку с названием репозитория из каждого события
-            lines = text.split('\n')
-            # Ищем и удаляем строку с названием репозитория в начале (без форматирования)
-            if len(lines) > 1 and repo_name in lines[1]:
-                # Если вторая строка содержит только название репо (может быть с тегами)
-                if lines[1].strip() == repo_name or lines[1].strip() == f"<b>{repo_name}</b>":
-                    lines.pop(1)
-            text = '\n'.join(lines)
-
-            grouped_text += f"{'─' * 30}\n"
-            grouped_text += text.strip() + "\n"
-
-        # Отправляем
-        if self.notification_func:
-            try:
-                await self.notification_func(
-                    chat_id=chat_id,
-                    text=grouped_text,
-                    event_key=None,
-                    edit_existing=False
-                )
-                logger.info(f"✅ Grouped notification ({len(filtered_events)} events) sent to chat {chat_id}")
-            except Exception as e:
-                logger.error(f"❌ Failed to send grouped notification to {chat_id}: {e}", exc_info=True)
+
+        # Чаты с одинаковым набором событий получают один и тот же текст
+        chats_by_events = {}
+        for chat_id in chat_ids:
+            indexes = tuple(i for i, item in enumerate(rendered) if chat_id in item.recipients)
+            if indexes:
+                chats_by_events.setdefault(indexes, []).append(chat_id)
+            else:
+                logger.info(f"No events passed filters for chat {chat_id}")
+
+        for indexes, chats in chats_by_events.items():
+            # Формируем сгруппированное сообщение
+            grouped_text = format_grouped_events(repo_name, [rendered[i].text for i in indexes])
+            await fan_out(
+                self.notification_func,
+                chats,
+                grouped_text,
+                event_key=None,
+                edit_existing=False,
+                description=f"grouped {len(indexes)} polled events for {repo_url}"
+            )
 
     def format_event(self, event_type: str, payload: dict) -> tuple[str, str]:
         """Форматирование события в текст сообщения"""
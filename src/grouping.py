@@ -0,0 +1,106 @@
+import asyncio
+import logging
+
+import redis
+
+from config import Config
+from delivery import fan_out
+from event_handlers import format_grouped_events
+from redis_storage import storage
+
+logger = logging.getLogger(__name__)
+
+# лимит длины сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+
+class GroupBuffer:
+    """
+    Группировка событий вебхуков для чатов с group_events: события копятся в Redis
+    по (чат, репозиторий) и отправляются одним сообщением раз в окно.
+    Буферы переживают перезапуск и общие для всех процессов приёма вебхуков
+    """
+
+    def __init__(self, window: int = 60, max_events: int = 20, interval: float = 5):
+        self.window = window
+        self.max_events = max_events
+        self.interval = interval
+        self.notification_func = None
+        self.flush_task = None
+
+    async def add(self, repo_url: str, chat_ids: set, text: str):
+        """
+        Добавить отформатированное событие в буферы чатов
+        """
+
+        await asyncio.to_thread(
+            storage.buffer_grouped_event, repo_url, list(chat_ids), text, self.window, self.max_events
+        )
+
+    async def start(self, notification_func):
+        """
+        Запуск периодической отправки буферов
+        """
+
+        self.notification_func = notification_func
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """
+        Остановка отправки. Неотправленные буферы остаются в Redis
+        """
+
+        if self.flush_task:
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+            self.flush_task = None
+
+    async def flush_due(self):
+        """
+        Отправить буферы, у которых истекло окно или набралось max_events событий
+        """
+
+        groups = await asyncio.to_thread(storage.claim_due_groups)
+        for chat_id, repo_url, texts in groups:
+            repo_name = repo_url.replace("https://github.com/", "")
+            for chunk in self._split(repo_name, texts):
+                await fan_out(
+                    self.notification_func,
+                    [chat_id],
+                    format_grouped_events(repo_name, chunk),
+                    description=f"grouped {len(chunk)} events for {repo_url}"
+                )
+
+    def _split(self, repo_name: str, texts: list) -> list:
+        """
+        Разбить события на сообщения, укладывающиеся в лимит длины Telegram.
+        Проверяется длина готового сообщения: заголовок и разделители событий
+        тоже занимают место (HTML-теги считаются с запасом)
+        """
+
+        chunks = [[]]
+        for text in texts:
+            if chunks[-1] and len(format_grouped_events(repo_name, chunks[-1] + [text])) > MAX_MESSAGE_LENGTH:
+                chunks.append([])
+            chunks[-1].append(text)
+        return chunks
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush_due()
+            except asyncio.CancelledError:
+                raise
+            except redis.RedisError as e:
+                logger.warning(f"Failed to flush grouped events: {e}")
+            except Exception as e:
+                logger.error(f"Failed to send grouped events: {e}", exc_info=True)
+
+
+group_buffer = GroupBuffer(
+    window=Config.GROUP_WINDOW,
+    max_events=Config.GROUP_MAX_EVENTS,
+    interval=Config.GROUP_FLUSH_INTERVAL
+)
@@ -1,10 +1,13 @@
 import asyncio
 import logging
+import multiprocessing
 import signal
 import sys
 from pathlib import Path
 
 from bot import bot, dp, send_notification
+from config import Config
+from delivery import dispatcher, event_messages
 from webhook_server import start_webhook_server
 
 # Создаём папку для логов
@@ -23,6 +26,43 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def run_webhook_process(number: int):
+    """
+    Дочерний процесс приёма вебхуков (общее состояние хранится в Redis)
+    """
+
+    async def serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+
+        runner = await start_webhook_server(notification_func=send_notification, reuse_port=True)
+        logger.info(f"Webhook worker process {number} started")
+        try:
+            await stop.wait()
+        finally:
+            await runner.cleanup()
+            await bot.session.close()
+
+    asyncio.run(serve())
+
+
+async def supervise_webhook_processes(processes: list):
+    """
+    Перезапуск упавших процессов приёма вебхуков
+    """
+
+    context = multiprocessing.get_context("spawn")
+    while True:
+        await asyncio.sleep(5)
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                logger.warning(f"Webhook worker process {i} exited with code {process.exitcode}, restarting")
+                processes[i] = context.Process(target=run_webhook_process, args=(i,), daemon=True)
+                processes[i].start()
+
+
 async def main():
     """
     Main обработчик бота и webhook сервера
@@ -30,9 +70,25 @@ async def main():
 
     logger.info("Starting GitHub Telegram Notification Bot (Webhook mode)...")
 
-    # Запуск webhook сервера для приёма событий от GitHub
-    webhook_runner = await start_webhook_server(notification_func=send_notification)
-    logger.info("Webhook server started - waiting for GitHub events")
+    webhook_runner = None
+    webhook_processes = []
+    supervisor = None
+
+    if Config.WEBHOOK_PROCESSES > 1:
+        # приём вебхуков в отдельных процессах, бот - только в этом
+        context = multiprocessing.get_context("spawn")
+        for i in range(Config.WEBHOOK_PROCESSES):
+            process = context.Process(target=run_webhook_process, args=(i,), daemon=True)
+            process.start()
+            webhook_processes.append(process)
+        supervisor = asyncio.create_task(supervise_webhook_processes(webhook_processes))
+        logger.info(f"Started {len(webhook_processes)} webhook worker processes on port {Config.WEBHOOK_PORT}")
+        # повторная отправка из dead-letter очереди (/dlq_replay) идёт с повторами и лимитами
+        await dispatcher.start()
+    else:
+        # Запуск webhook сервера для приёма событий от GitHub
+        webhook_runner = await start_webhook_server(notification_func=send_notification)
+        logger.info("Webhook server started - waiting for GitHub events")
 
     # Запуск telegram бота
     try:
@@ -43,7 +99,16 @@ async def main():
     finally:
         # Очистка ресурсов
         logger.info("Shutting down...")
-        await webhook_runner.cleanup()
+        if supervisor:
+            supervisor.cancel()
+        for process in webhook_processes:
+            process.terminate()
+        for process in webhook_processes:
+            process.join(timeout=10)
+        if webhook_runner:
+            await webhook_runner.cleanup()
+        await dispatcher.stop()
+        await event_messages.flush()
         await bot.session.close()
 
 
@@ -0,0 +1,178 @@
+import time
+from bisect import bisect_left
+
+
+"""
+Метрики в формате Prometheus без внешних зависимостей.
+Запись - это словарь + сложение, поэтому метрики можно держать включёнными на горячем пути
+"""
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _registry.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Монотонно растущий счётчик
+    """
+
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение
+    """
+
+    type = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма длительностей (в секундах)
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        state = self.values.get(labels)
+        if state is None:
+            # [счётчики по корзинам (+Inf последней), сумма]
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def time(self, *labels) -> _Timer:
+        return _Timer(self, labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labels, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {total}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    """
+    Все метрики в текстовом формате Prometheus
+    """
+
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_DURATION = Histogram(
+    "webhook_stage_duration_seconds",
+    "Duration of webhook pipeline stages",
+    ("stage",)
+)
+EVENTS_TOTAL = Counter(
+    "webhook_events_total",
+    "Received GitHub events by type",
+    ("event_type",)
+)
+FILTERED_TOTAL = Counter(
+    "webhook_filtered_total",
+    "Recipients dropped by chat filters and quotas",
+    ("reason",)
+)
+SEND_FAILURES_TOTAL = Counter(
+    "telegram_send_failures_total",
+    "Failed Telegram notification sends",
+    ("error",)
+)
+CHATS_PRUNED_TOTAL = Counter(
+    "telegram_chats_pruned_total",
+    "Chats unsubscribed after a permanent delivery error",
+    ("error",)
+)
+IN_FLIGHT = Gauge(
+    "webhook_requests_in_flight",
+    "Webhook requests currently being handled"
+)
+FANOUT_SIZE = Gauge(
+    "webhook_fanout_recipients",
+    "Number of recipient chats of the last processed event"
+)
+DELIVERY_QUEUE_DEPTH = Gauge(
+    "delivery_partition_queue_depth",
+    "Pending notifications in each ordered delivery partition",
+    ("partition",)
+)
+DELIVERY_PARKED_CHATS = Gauge(
+    "delivery_parked_chats",
+    "Chats waiting for a Telegram rate limit token or retry_after"
+)
+DEAD_LETTERS_TOTAL = Counter(
+    "delivery_dead_letters_total",
+    "Notifications moved to the dead-letter queue after exhausting retries"
+)
@@ -0,0 +1,53 @@
+import json
+from typing import NamedTuple, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, используем стандартный json
+    orjson = None
+
+
+class EventInfo(NamedTuple):
+    """
+    Поля события, нужные для маршрутизации
+    """
+
+    repo_url: Optional[str]
+    action: Optional[str]
+    sender: Optional[str]
+
+
+def loads(data):
+    """
+    Разбор JSON из bytes/str (orjson, если установлен)
+    """
+
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    """
+    Сериализация в JSON-строку (orjson, если установлен)
+    """
+
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def extract_event_info(payload: dict) -> EventInfo:
+    """
+    Достать URL репозитория, action и отправителя без обхода остального payload
+    """
+
+    repo = payload.get("repository") or {}
+    sender = payload.get("sender") or {}
+    repo_url = repo.get("html_url")
+
+    return EventInfo(
+        repo_url=repo_url.rstrip("/") if repo_url else None,
+        action=payload.get("action"),
+        sender=sender.get("login")
+    )
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from typing import Optional
+
+import redis
+
+from config import Config
+from delivery import event_messages, fan_out
+from metrics import FILTERED_TOTAL
+from redis_storage import storage
+
+logger = logging.getLogger(__name__)
+
+
+def format_quota_summary(repo_url: str, counts: dict, authors: int, quota: Optional[int], window: int) -> str:
+    """
+    Текст сводки событий сверх квоты
+    """
+
+    repo_name = repo_url.replace("https://github.com/", "")
+    total = sum(counts.values())
+    by_type = ", ".join(f"{event_type}: {n}" for event_type, n in sorted(counts.items(), key=lambda x: -x[1]))
+
+    text = f"📉 <b>{repo_name}</b>\n"
+    if quota:
+        text += f"<i>Превышена квота: {quota} событий за {window // 60} мин</i>\n\n"
+    text += f"+{total} событий ({by_type})"
+    if authors:
+        text += f" от {authors} авторов"
+    text += f" за последние {window // 60} мин"
+    return text
+
+
+class QuotaLimiter:
+    """
+    Квоты событий на (чат, репозиторий). События сверх квоты не отправляются по одному,
+    а собираются в сводку, которая периодически обновляется одним сообщением
+    """
+
+    def __init__(self, window: int = 600, interval: int = 60):
+        self.window = window
+        self.interval = interval
+        self.notification_func = None
+        self.flush_task = None
+
+    async def apply(self, repo_url: str, chat_ids: set, quotas: dict, filter_event_type: str,
+                    author: str = None, event_key: str = None) -> tuple[set, int]:
+        """
+        Учесть событие в квотах: (чаты, которым отправлять, отсеяно квотой).
+        Обновления сообщения, которое уже есть в чате (event_key), квоту не расходуют,
+        иначе сообщение осталось бы в промежуточном состоянии.
+        При ошибке Redis событие отправляется всем
+        """
+
+        limited = {chat_id: quotas[chat_id] for chat_id in chat_ids if chat_id in quotas}
+        if limited and event_key:
+            loaded = await event_messages.load(event_key)
+            limited = {
+                chat_id: quota for chat_id, quota in limited.items()
+                if not event_messages.lookup(event_key, chat_id, loaded)
+            }
+        if not limited:
+            return chat_ids, 0
+
+        try:
+            exceeded = await asyncio.to_thread(
+                storage.consume_quota, repo_url, limited, self.window, filter_event_type, author
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Failed to check quotas for {repo_url}: {e}")
+            return chat_ids, 0
+
+        if not exceeded:
+            return chat_ids, 0
+
+        FILTERED_TOTAL.inc("quota", amount=len(exceeded))
+        return chat_ids - exceeded, len(exceeded)
+
+    async def start(self, notification_func):
+        """
+        Запуск периодической отправки сводок
+        """
+
+        self.notification_func = notification_func
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """
+        Остановка отправки сводок
+        """
+
+        if self.flush_task:
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+            self.flush_task = None
+
+    async def flush(self):
+        """
+        Отправить или обновить сводки, изменившиеся с прошлого раза.
+        Сводку забирает один процесс (ZPOPMIN), поэтому процессы не дублируют друг друга
+        """
+
+        summaries = await asyncio.to_thread(storage.pop_quota_summaries)
+        for chat_id, repo_url, window_start, counts, authors in summaries:
+            filters = await asyncio.to_thread(storage.get_filters, chat_id, repo_url)
+            quota = filters.get("quota") if filters else None
+            text = format_quota_summary(repo_url, counts, authors, quota, self.window)
+            # одно сообщение на окно, дальше оно редактируется
+            await fan_out(
+                self.notification_func,
+                [chat_id],
+                text,
+                event_key=f"quota:{repo_url}:{window_start}",
+                edit_existing=True,
+                description=f"quota summary for {repo_url}"
+            )
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to send quota summaries: {e}", exc_info=True)
+
+
+quota_limiter = QuotaLimiter(window=Config.QUOTA_WINDOW, interval=Config.QUOTA_SUMMARY_INTERVAL)
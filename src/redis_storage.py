@@ -1,14 +1,146 @@
 import json
+import time
 from typing import Optional
 import redis
 
 from config import Config
+from filters import RULES
 
 
 """
 Хранилище redis
 """
 
+# канал pub/sub с изменениями подписок (см. subscriptions_cache.py)
+SUBSCRIPTION_CHANGES_CHANNEL = "subscription_changes"
+
+# сводки событий сверх квоты, ожидающие отправки: "{chat_id}:{начало окна}:{repo_url}" -> время
+QUOTA_PENDING_KEY = "quota_pending"
+
+# сообщения, не доставленные после всех повторов (новые - в начале списка)
+DEAD_LETTERS_KEY = "dead_letters"
+
+# сроки отправки буферов группировки: "{chat_id}:{repo_url}" -> время отправки
+GROUP_FLUSH_KEY = "group_flush"
+# время хранения буфера группировки, если его никто не отправил
+GROUP_BUFFER_TTL = 86400
+
+# Отбор чатов, фильтры которых пропускают событие, внутри Redis.
+# KEYS[1] - repo_chats:{repo_url}; ARGV - repo_url, тип события для фильтра, автор.
+# Возвращает {отсеяно по типу, отсеяно по автору, chat_id...}.
+# Читает ключи subscriptions:* не из KEYS, поэтому работает только без Redis Cluster
+ELIGIBLE_CHATS_SCRIPT = """
+local repo_url = ARGV[1]
+local event_type = ARGV[2]
+local author = ARGV[3]
+local dropped_by_type = 0
+local dropped_by_author = 0
+local eligible = {dropped_by_type, dropped_by_author}
+
+-- расширенные настройки: правила (ARGV[4..]), квота или группировка
+local function has_extras(filters)
+    if filters['group_events'] == true or type(filters['quota']) == 'number' then
+        return true
+    end
+    for i = 4, #ARGV do
+        local rule = filters[ARGV[i]]
+        if type(rule) == 'table' and next(rule) ~= nil then
+            return true
+        end
+    end
+    return false
+end
+
+for _, chat_id in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local accepted = true
+    local data = redis.call('HGET', 'subscriptions:' .. chat_id, repo_url)
+    local filters = data and cjson.decode(data)['filters']
+    local extras = ''
+
+    if type(filters) == 'table' then
+        local event_types = filters['event_types']
+        if type(event_types) == 'table' and #event_types > 0 then
+            accepted = false
+            for _, value in ipairs(event_types) do
+                if value == event_type then
+                    accepted = true
+                    break
+                end
+            end
+            if not accepted then
+                dropped_by_type = dropped_by_type + 1
+            end
+        end
+
+        local excluded = filters['excluded_authors']
+        if accepted and author ~= '' and type(excluded) == 'table' then
+            for _, value in ipairs(excluded) do
+                if value == author then
+                    accepted = false
+                    dropped_by_author = dropped_by_author + 1
+                    break
+                end
+            end
+        end
+
+        if accepted and has_extras(filters) then
+            extras = data
+        end
+    end
+
+    if accepted then
+        table.insert(eligible, chat_id)
+        table.insert(eligible, extras)
+    end
+end
+
+eligible[1] = dropped_by_type
+eligible[2] = dropped_by_author
+return eligible
+"""
+
+# ведро общего лимита отправок в Telegram (ключ ведра чата - send_rate:{chat_id})
+SEND_RATE_GLOBAL_KEY = "send_rate:global"
+
+# Общие для всех процессов вёдра токенов: токен берётся из ведра чата и общего ведра
+# одновременно. Возвращает {ведро без токена ('chat' / 'global' / ''), секунд до токена}
+SEND_TOKEN_SCRIPT = """
+redis.replicate_commands()
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local function refill(key, rate, capacity)
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(state[1])
+    if not tokens then
+        return capacity
+    end
+    return math.min(capacity, tokens + math.max(0, now - tonumber(state[2])) * rate)
+end
+
+local function store(key, tokens, rate, capacity)
+    redis.call('HSET', key, 'tokens', string.format('%.6f', tokens), 'updated', string.format('%.6f', now))
+    -- полное ведро не отличается от нового, поэтому ключ живёт, пока ведро не наполнится
+    redis.call('PEXPIRE', key, math.ceil((capacity - tokens) / rate * 1000) + 1000)
+end
+
+local global_rate, global_capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+local chat_rate, chat_capacity = tonumber(ARGV[3]), tonumber(ARGV[4])
+
+local chat = refill(KEYS[2], chat_rate, chat_capacity)
+if chat < 1 then
+    return {'chat', string.format('%.6f', (1 - chat) / chat_rate)}
+end
+local global = refill(KEYS[1], global_rate, global_capacity)
+if global < 1 then
+    return {'global', string.format('%.6f', (1 - global) / global_rate)}
+end
+
+store(KEYS[1], global - 1, global_rate, global_capacity)
+store(KEYS[2], chat - 1, chat_rate, chat_capacity)
+return {'', '0'}
+"""
+
 class RedisStorage:
     def __init__(self):
         self.client = redis.Redis(
@@ -18,6 +150,9 @@ class RedisStorage:
             password=Config.REDIS_PASSWORD,
             decode_responses=True
         )
+        # EVALSHA с автоматической загрузкой скрипта при NOSCRIPT
+        self.eligible_chats_script = self.client.register_script(ELIGIBLE_CHATS_SCRIPT)
+        self.send_token_script = self.client.register_script(SEND_TOKEN_SCRIPT)
 
 
     def add_subscription(self, chat_id: int, repo_url: str, webhook_id: int = None) -> bool:
@@ -25,7 +160,6 @@ class RedisStorage:
         Добавить подписку на заданный репозиторий
         """
 
-        key = f"subscriptions:{chat_id}"
         data = {
             "repo_url": repo_url,
             "webhook_id": webhook_id,
@@ -35,7 +169,17 @@ class RedisStorage:
                 "group_events": False  # По умолчанию - отдельные сообщения
             }
         }
-        return self.client.hset(key, repo_url, json.dumps(data))
+        return self._save_subscription(chat_id, repo_url, data)
+
+    def _save_subscription(self, chat_id: int, repo_url: str, sub: dict) -> bool:
+        """
+        Сохранить подписку и оповестить процессы об изменении фильтров
+        """
+
+        key = f"subscriptions:{chat_id}"
+        result = self.client.hset(key, repo_url, json.dumps(sub))
+        self.publish_subscription_change("filters", repo_url)
+        return result
 
     def get_subscription(self, chat_id: int, repo_url: str) -> Optional[dict]:
         """
@@ -61,7 +205,9 @@ class RedisStorage:
         """
 
         key = f"subscriptions:{chat_id}"
-        return self.client.hdel(key, repo_url) > 0
+        removed = self.client.hdel(key, repo_url) > 0
+        self.publish_subscription_change("filters", repo_url)
+        return removed
 
     def update_webhook_id(self, chat_id: int, repo_url: str, webhook_id: int) -> bool:
         """
@@ -71,8 +217,7 @@ class RedisStorage:
         sub = self.get_subscription(chat_id, repo_url)
         if sub:
             sub["webhook_id"] = webhook_id
-            key = f"subscriptions:{chat_id}"
-            return self.client.hset(key, repo_url, json.dumps(sub))
+            return self._save_subscription(chat_id, repo_url, sub)
         return False
 
 
@@ -84,8 +229,7 @@ class RedisStorage:
         sub = self.get_subscription(chat_id, repo_url)
         if sub:
             sub["filters"]["excluded_authors"] = authors
-            key = f"subscriptions:{chat_id}"
-            return self.client.hset(key, repo_url, json.dumps(sub))
+            return self._save_subscription(chat_id, repo_url, sub)
         return False
 
     def add_excluded_author(self, chat_id: int, repo_url: str, author: str) -> bool:
@@ -97,8 +241,7 @@ class RedisStorage:
         if sub:
             if author not in sub["filters"]["excluded_authors"]:
                 sub["filters"]["excluded_authors"].append(author)
-            key = f"subscriptions:{chat_id}"
-            return self.client.hset(key, repo_url, json.dumps(sub))
+            return self._save_subscription(chat_id, repo_url, sub)
         return False
 
     def remove_excluded_author(self, chat_id: int, repo_url: str, author: str) -> bool:
@@ -109,8 +252,7 @@ class RedisStorage:
         sub = self.get_subscription(chat_id, repo_url)
         if sub and author in sub["filters"]["excluded_authors"]:
             sub["filters"]["excluded_authors"].remove(author)
-            key = f"subscriptions:{chat_id}"
-            return self.client.hset(key, repo_url, json.dumps(sub))
+            return self._save_subscription(chat_id, repo_url, sub)
         return False
 
     def set_event_types(self, chat_id: int, repo_url: str, event_types: list) -> bool:
@@ -121,8 +263,36 @@ class RedisStorage:
         sub = self.get_subscription(chat_id, repo_url)
         if sub:
             sub["filters"]["event_types"] = event_types
-            key = f"subscriptions:{chat_id}"
-            return self.client.hset(key, repo_url, json.dumps(sub))
+            return self._save_subscription(chat_id, repo_url, sub)
+        return False
+
+    def set_filter_rule(self, chat_id: int, repo_url: str, rule: str, patterns: list) -> bool:
+        """
+        Установить расширенное правило фильтра (ветки, пути, метки, workflow).
+        Пустой список удаляет правило
+        """
+
+        sub = self.get_subscription(chat_id, repo_url)
+        if sub:
+            if patterns:
+                sub["filters"][rule] = patterns
+            else:
+                sub["filters"].pop(rule, None)
+            return self._save_subscription(chat_id, repo_url, sub)
+        return False
+
+    def set_event_quota(self, chat_id: int, repo_url: str, quota: int) -> bool:
+        """
+        Установить квоту событий за окно QUOTA_WINDOW (0 - без квоты)
+        """
+
+        sub = self.get_subscription(chat_id, repo_url)
+        if sub:
+            if quota:
+                sub["filters"]["quota"] = quota
+            else:
+                sub["filters"].pop("quota", None)
+            return self._save_subscription(chat_id, repo_url, sub)
         return False
 
     def get_filters(self, chat_id: int, repo_url: str) -> Optional[dict]:
@@ -133,6 +303,55 @@ class RedisStorage:
         sub = self.get_subscription(chat_id, repo_url)
         return sub["filters"] if sub else None
 
+    def get_filters_for_repo(self, repo_url: str) -> dict:
+        """
+        Получить фильтры всех чатов, подписанных на репозиторий: {chat_id: filters}.
+        Подписки читаются одним конвейером (pipeline) вместо HGET на каждый чат
+        """
+
+        chat_ids = list(self.get_chats_for_repo(repo_url))
+        if not chat_ids:
+            return {}
+
+        pipe = self.client.pipeline(transaction=False)
+        for chat_id in chat_ids:
+            pipe.hget(f"subscriptions:{chat_id}", repo_url)
+
+        result = {}
+        for chat_id, data in zip(chat_ids, pipe.execute()):
+            result[chat_id] = json.loads(data)["filters"] if data else None
+        return result
+
+    def get_eligible_chats(self, repo_url: str, filter_event_type: str,
+                           author: str = None) -> tuple[dict, int, int]:
+        """
+        Отбор получателей события скриптом на стороне Redis:
+        ({чат: фильтры}, отсеяно по типу, отсеяно по автору).
+        Фильтры передаются только для чатов с правилами, квотой или группировкой, у остальных None
+        """
+
+        result = self.eligible_chats_script(
+            keys=[f"repo_chats:{repo_url}"],
+            args=[repo_url, filter_event_type, author or "", *RULES]
+        )
+        eligible = {
+            int(chat_id): json.loads(data)["filters"] if data else None
+            for chat_id, data in zip(result[2::2], result[3::2])
+        }
+        return eligible, int(result[0]), int(result[1])
+
+    def take_send_token(self, chat_id: int, chat_rate: float, chat_capacity: float,
+                        global_rate: float, global_capacity: float) -> tuple[str, float]:
+        """
+        Взять токен отправки в чат из общих для всех процессов вёдер:
+        ('', 0) - токен получен, ('chat' / 'global', секунд до токена) - ведро пусто
+        """
+
+        scope, delay = self.send_token_script(
+            keys=[SEND_RATE_GLOBAL_KEY, f"send_rate:{chat_id}"],
+            args=[global_rate, global_capacity, chat_rate, chat_capacity]
+        )
+        return scope, float(delay)
 
     def add_repo_chat_mapping(self, repo_url: str, chat_id: int):
         """
@@ -141,6 +360,7 @@ class RedisStorage:
 
         key = f"repo_chats:{repo_url}"
         self.client.sadd(key, chat_id)
+        self.publish_subscription_change("add", repo_url)
 
     def get_chats_for_repo(self, repo_url: str) -> set:
         """
@@ -157,33 +377,232 @@ class RedisStorage:
 
         key = f"repo_chats:{repo_url}"
         self.client.srem(key, chat_id)
+        self.publish_subscription_change("remove", repo_url)
+
+    def remove_chat(self, chat_id: int) -> dict:
+        """
+        Удалить все подписки чата (чат удалён или заблокировал бота).
+        Возвращает {repo_url: webhook_id} репозиториев, у которых не осталось подписчиков
+        """
+
+        subs = self.get_all_subscriptions(chat_id)
+        self.client.delete(f"subscriptions:{chat_id}")
+
+        orphaned = {}
+        for repo_url, sub in subs.items():
+            self.remove_repo_chat_mapping(repo_url, chat_id)
+            if not self.client.scard(f"repo_chats:{repo_url}"):
+                orphaned[repo_url] = sub.get("webhook_id")
+        return orphaned
+
+    def migrate_chat(self, old_chat_id: int, new_chat_id: int):
+        """
+        Перенести подписки группы, преобразованной в супергруппу, на новый ID чата
+        """
+
+        subs = self.client.hgetall(f"subscriptions:{old_chat_id}")
+        if not subs:
+            return
+
+        self.client.hset(f"subscriptions:{new_chat_id}", mapping=subs)
+        self.client.delete(f"subscriptions:{old_chat_id}")
+        for repo_url in subs:
+            self.client.sadd(f"repo_chats:{repo_url}", new_chat_id)
+            self.client.srem(f"repo_chats:{repo_url}", old_chat_id)
+            self.publish_subscription_change("filters", repo_url)
+
+    def get_subscribed_repos(self) -> set:
+        """
+        Получить все репозитории, на которые есть подписки
+        """
+
+        return {key.replace("repo_chats:", "", 1) for key in self.client.scan_iter("repo_chats:*")}
+
+    def publish_subscription_change(self, action: str, repo_url: str):
+        """
+        Оповестить процессы об изменении подписок на репозиторий
+        """
 
+        self.client.publish(SUBSCRIPTION_CHANGES_CHANNEL, json.dumps({
+            "action": action,
+            "repo_url": repo_url
+        }))
 
-    def save_message_id(self, chat_id: int, event_key: str, message_id: int):
+    def get_event_messages(self, event_key: str) -> dict:
         """
-        Сохранить ID сообщения для редактирования
+        Получить сообщения события во всех чатах: {chat_id: (message_id, хэш текста)}
         """
 
-        key = f"messages:{chat_id}"
-        self.client.hset(key, event_key, message_id)
-        self.client.expire(key, 86400)  # 24 часа
+        key = f"event_messages:{event_key}"
+        result = {}
+        for chat_id, value in self.client.hgetall(key).items():
+            # значение - "message_id:хэш" (без хэша у записей старого формата)
+            msg_id, _, digest = value.partition(":")
+            result[int(chat_id)] = (int(msg_id), digest or None)
+        return result
 
-    def get_message_id(self, chat_id: int, event_key: str) -> Optional[int]:
+    def save_event_messages(self, event_key: str, messages: dict, ttl: int):
         """
-        Получить ID заданного сохранённого сообщения
+        Сохранить сообщения события {chat_id: (message_id, хэш текста)} одним запросом
         """
 
-        key = f"messages:{chat_id}"
-        msg_id = self.client.hget(key, event_key)
-        return int(msg_id) if msg_id else None
+        key = f"event_messages:{event_key}"
+        mapping = {
+            chat_id: f"{msg_id}:{digest}" if digest else msg_id
+            for chat_id, (msg_id, digest) in messages.items()
+        }
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def consume_quota(self, repo_url: str, quotas: dict, window: int,
+                      event_type: str, author: str = None) -> set:
+        """
+        Учесть событие в квотах чатов {chat_id: квота}. Возвращает чаты, превысившие квоту;
+        для них событие добавляется в сводку текущего окна
+        """
+
+        window_start = int(time.time()) // window * window
+        chat_ids = list(quotas)
+
+        pipe = self.client.pipeline(transaction=False)
+        for chat_id in chat_ids:
+            key = f"quota:{chat_id}:{window_start}:{repo_url}"
+            pipe.incr(key)
+            pipe.expire(key, window)
+        counts = pipe.execute()[::2]
+
+        exceeded = {chat_id for chat_id, count in zip(chat_ids, counts) if count > quotas[chat_id]}
+        if not exceeded:
+            return exceeded
+
+        pipe = self.client.pipeline(transaction=False)
+        for chat_id in exceeded:
+            suffix = f"{chat_id}:{window_start}:{repo_url}"
+            pipe.hincrby(f"quota_summary:{suffix}", event_type, 1)
+            pipe.expire(f"quota_summary:{suffix}", window * 2)
+            if author:
+                pipe.sadd(f"quota_authors:{suffix}", author)
+                pipe.expire(f"quota_authors:{suffix}", window * 2)
+            pipe.zadd(QUOTA_PENDING_KEY, {suffix: time.time()})
+        pipe.execute()
+        return exceeded
 
-    def delete_message_id(self, chat_id: int, event_key: str):
+    def pop_quota_summaries(self, count: int = 100) -> list:
         """
-        Удалить сохранённый ID сообщения
+        Забрать изменившиеся сводки событий сверх квоты:
+        [(chat_id, repo_url, начало окна, {тип события: число}, число авторов)]
         """
 
-        key = f"messages:{chat_id}"
-        self.client.hdel(key, event_key)
+        pending = [member for member, _ in self.client.zpopmin(QUOTA_PENDING_KEY, count)]
+        if not pending:
+            return []
+
+        pipe = self.client.pipeline(transaction=False)
+        for suffix in pending:
+            pipe.hgetall(f"quota_summary:{suffix}")
+            pipe.scard(f"quota_authors:{suffix}")
+        results = pipe.execute()
+
+        summaries = []
+        for i, suffix in enumerate(pending):
+            chat_id, window_start, repo_url = suffix.split(":", 2)
+            counts = {event_type: int(n) for event_type, n in results[i * 2].items()}
+            if counts:
+                summaries.append((int(chat_id), repo_url, int(window_start), counts, results[i * 2 + 1]))
+        return summaries
+
+    def count_event_update(self, event_key: str, ttl: int) -> int:
+        """
+        Номер обновления события (общий для всех процессов)
+        """
+
+        key = f"event_updates:{event_key}"
+        pipe = self.client.pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, ttl)
+        return pipe.execute()[0]
+
+    def get_event_update_count(self, event_key: str) -> int:
+        """
+        Номер последнего обновления события
+        """
+
+        return int(self.client.get(f"event_updates:{event_key}") or 0)
+
+    def buffer_grouped_event(self, repo_url: str, chat_ids: list, text: str, window: int, max_events: int):
+        """
+        Добавить событие в буферы группировки чатов. Буфер отправляется через window секунд
+        после первого события или сразу, когда в нём набралось max_events событий
+        """
+
+        pipe = self.client.pipeline(transaction=False)
+        for chat_id in chat_ids:
+            key = f"group_buffer:{chat_id}:{repo_url}"
+            pipe.rpush(key, text)
+            pipe.expire(key, GROUP_BUFFER_TTL)
+        lengths = pipe.execute()[::2]
+
+        deadline = time.time() + window
+        pipe = self.client.pipeline(transaction=False)
+        for chat_id, length in zip(chat_ids, lengths):
+            member = f"{chat_id}:{repo_url}"
+            if length >= max_events:
+                pipe.zadd(GROUP_FLUSH_KEY, {member: 0})
+            else:
+                pipe.zadd(GROUP_FLUSH_KEY, {member: deadline}, nx=True)
+        pipe.execute()
+
+    def claim_due_groups(self, count: int = 100) -> list:
+        """
+        Забрать буферы группировки, которым пора отправляться: [(chat_id, repo_url, [тексты])].
+        Буфер забирает только процесс, удаливший его из GROUP_FLUSH_KEY
+        """
+
+        claimed = []
+        for member in self.client.zrangebyscore(GROUP_FLUSH_KEY, 0, time.time(), start=0, num=count):
+            if not self.client.zrem(GROUP_FLUSH_KEY, member):
+                continue  # забрал другой процесс
+
+            chat_id, repo_url = member.split(":", 1)
+            key = f"group_buffer:{member}"
+            pipe = self.client.pipeline(transaction=True)
+            pipe.lrange(key, 0, -1)
+            pipe.delete(key)
+            texts, _ = pipe.execute()
+            if texts:
+                claimed.append((int(chat_id), repo_url, texts))
+        return claimed
+
+    def push_dead_letter(self, entry: dict, maxlen: int):
+        """
+        Добавить недоставленное сообщение в dead-letter очередь
+        """
+
+        pipe = self.client.pipeline(transaction=False)
+        pipe.lpush(DEAD_LETTERS_KEY, json.dumps(entry))
+        pipe.ltrim(DEAD_LETTERS_KEY, 0, maxlen - 1)
+        pipe.execute()
+
+    def get_dead_letters(self, count: int = 10) -> tuple[list, int]:
+        """
+        Последние недоставленные сообщения и общее их число
+        """
+
+        pipe = self.client.pipeline(transaction=False)
+        pipe.lrange(DEAD_LETTERS_KEY, 0, count - 1)
+        pipe.llen(DEAD_LETTERS_KEY)
+        entries, total = pipe.execute()
+        return [json.loads(entry) for entry in entries], total
+
+    def pop_dead_letters(self, count: int) -> list:
+        """
+        Забрать самые старые недоставленные сообщения для повторной отправки
+        """
+
+        entries = self.client.rpop(DEAD_LETTERS_KEY, count) or []
+        return [json.loads(entry) for entry in entries]
 
     def set_last_event_id(self, repo_url: str, event_id: str):
         """
@@ -201,6 +620,39 @@ class RedisStorage:
         key = f"last_event:{repo_url}"
         return self.client.get(key)
 
+    def mark_delivery_seen(self, delivery_id: str, ttl: int) -> bool:
+        """
+        Отметить доставку вебхука как полученную. Возвращает False, если она уже была
+        """
+
+        key = f"delivery:{delivery_id}"
+        return bool(self.client.set(key, 1, nx=True, ex=ttl))
+
+    def forget_delivery(self, delivery_id: str):
+        """
+        Удалить отметку о доставке вебхука
+        """
+
+        key = f"delivery:{delivery_id}"
+        self.client.delete(key)
+
+    def cache_pr_commits(self, full_name: str, pr_number: int, head_sha: str, commits: list, ttl: int):
+        """
+        Закэшировать коммиты PR для заданного head.sha
+        """
+
+        key = f"pr_commits:{full_name}:{pr_number}:{head_sha}"
+        self.client.set(key, json.dumps(commits), ex=ttl)
+
+    def get_cached_pr_commits(self, full_name: str, pr_number: int, head_sha: str) -> Optional[list]:
+        """
+        Получить закэшированные коммиты PR
+        """
+
+        key = f"pr_commits:{full_name}:{pr_number}:{head_sha}"
+        data = self.client.get(key)
+        return json.loads(data) if data else None
+
     def set_group_events(self, chat_id: int, repo_url: str, group_events: bool) -> bool:
         """
         Установить режим группировки событий
@@ -209,8 +661,7 @@ class RedisStorage:
         sub = self.get_subscription(chat_id, repo_url)
         if sub:
             sub["filters"]["group_events"] = group_events
-            key = f"subscriptions:{chat_id}"
-            return self.client.hset(key, repo_url, json.dumps(sub))
+            return self._save_subscription(chat_id, repo_url, sub)
         return False
 
     def get_group_events(self, chat_id: int, repo_url: str) -> bool:
@@ -0,0 +1,194 @@
+import logging
+from typing import NamedTuple
+
+from config import Config
+from filters import EventAttributes, compile_filter
+from redis_storage import storage
+from subscriptions_cache import subscribed_repos
+
+logger = logging.getLogger(__name__)
+
+
+class Resolution(NamedTuple):
+    """
+    Получатели события и всё, что нужно для их рассылки
+    """
+
+    recipients: set
+    dropped_by_type: int
+    dropped_by_author: int
+    dropped_by_rule: int
+    quotas: dict    # чат -> квота событий за окно
+    grouped: set    # получатели с группировкой событий
+
+
+class RepoRoutes:
+    """
+    Предвычисленные фильтры всех чатов одного репозитория
+    """
+
+    __slots__ = ("chats", "all_types", "chats_by_type", "excluded_by_author", "grouped", "rules", "quotas")
+
+    def __init__(self):
+        self.chats = set()               # все подписанные чаты
+        self.all_types = set()           # чаты без ограничения по типам событий
+        self.chats_by_type = {}          # тип события для фильтра -> чаты
+        self.excluded_by_author = {}     # автор -> чаты, исключившие его
+        self.grouped = set()             # чаты с группировкой событий
+        self.rules = {}                  # чат -> скомпилированные расширенные правила
+        self.quotas = {}                 # чат -> квота событий за окно
+
+    def add_chat(self, chat_id: int, filters: dict = None):
+        """
+        Добавить чат с его фильтрами
+        """
+
+        self.chats.add(chat_id)
+        if not filters:
+            self.all_types.add(chat_id)
+            return
+
+        event_types = filters.get("event_types", [])
+        if event_types:
+            for event_type in event_types:
+                self.chats_by_type.setdefault(event_type, set()).add(chat_id)
+        else:
+            self.all_types.add(chat_id)
+
+        for author in filters.get("excluded_authors", []):
+            self.excluded_by_author.setdefault(author, set()).add(chat_id)
+
+        if filters.get("group_events", False):
+            self.grouped.add(chat_id)
+
+        compiled = compile_filter(filters)
+        if compiled:
+            self.rules[chat_id] = compiled
+
+        if filters.get("quota"):
+            self.quotas[chat_id] = int(filters["quota"])
+
+    def resolve(self, filter_event_type: str, author: str = None,
+                attrs: EventAttributes = None) -> Resolution:
+        """
+        Получатели события с учётом типа, автора и расширенных правил
+        """
+
+        accepted = self.all_types | self.chats_by_type.get(filter_event_type, set())
+        dropped_by_type = len(self.chats) - len(accepted)
+
+        dropped_by_author = 0
+        excluded = self.excluded_by_author.get(author) if author else None
+        if excluded:
+            recipients = accepted - excluded
+            dropped_by_author = len(accepted) - len(recipients)
+            accepted = recipients
+
+        recipients, dropped_by_rule = self.apply_rules(accepted, attrs)
+        return Resolution(recipients, dropped_by_type, dropped_by_author, dropped_by_rule,
+                          self.quotas, self.grouped & recipients)
+
+    def apply_rules(self, chat_ids: set, attrs: EventAttributes = None) -> tuple[set, int]:
+        """
+        Отсев чатов расширенными правилами: (оставшиеся чаты, отсеяно)
+        """
+
+        if not self.rules or attrs is None:
+            return chat_ids, 0
+
+        rejected = {
+            chat_id for chat_id in chat_ids
+            if chat_id in self.rules and not self.rules[chat_id].matches(attrs)
+        }
+        if rejected:
+            return chat_ids - rejected, len(rejected)
+        return chat_ids, 0
+
+
+class RoutingIndex:
+    """
+    Индекс маршрутизации: repo_url -> RepoRoutes.
+    Строится при первом обращении и сбрасывается при изменении подписок и фильтров
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.generation = 0  # растёт при каждом сбросе, чтобы не сохранить устаревшие маршруты
+        subscribed_repos.add_listener(self._on_subscription_change)
+
+    def get_routes(self, repo_url: str) -> RepoRoutes:
+        """
+        Маршруты репозитория (из кэша или Redis)
+        """
+
+        routes = self.routes.get(repo_url)
+        if routes is not None:
+            return routes
+
+        generation = self.generation
+        routes = self._build(repo_url)
+        # кэшируем только пока получаем уведомления об изменениях
+        if subscribed_repos.loaded and generation == self.generation:
+            self.routes[repo_url] = routes
+        return routes
+
+    def get_chats(self, repo_url: str) -> set:
+        """
+        Все подписанные чаты репозитория
+        """
+
+        if Config.ROUTING_MODE == "lua":
+            return storage.get_chats_for_repo(repo_url)
+        return self.get_routes(repo_url).chats
+
+    def resolve(self, repo_url: str, filter_event_type: str, author: str = None,
+                attrs: EventAttributes = None) -> Resolution:
+        """
+        Получатели события, их квоты и группировка.
+        При ROUTING_MODE=lua тип и автор проверяются скриптом внутри Redis, индекс не строится:
+        скрипт возвращает подписки только тех получателей, у которых есть правила, квота
+        или группировка, и их правила компилируются на каждое событие
+        """
+
+        if Config.ROUTING_MODE == "lua":
+            eligible, dropped_by_type, dropped_by_author = storage.get_eligible_chats(
+                repo_url, filter_event_type, author
+            )
+            routes = RepoRoutes()
+            for chat_id, filters in eligible.items():
+                routes.add_chat(chat_id, filters)
+            recipients, dropped_by_rule = routes.apply_rules(routes.chats, attrs)
+            return Resolution(recipients, dropped_by_type, dropped_by_author, dropped_by_rule,
+                              routes.quotas, routes.grouped & recipients)
+        return self.get_routes(repo_url).resolve(filter_event_type, author, attrs)
+
+    def invalidate(self, repo_url: str = None):
+        """
+        Сбросить маршруты репозитория (или все)
+        """
+
+        self.generation += 1
+        if repo_url is None:
+            self.routes.clear()
+        else:
+            self.routes.pop(repo_url, None)
+
+    def _build(self, repo_url: str) -> RepoRoutes:
+        """
+        Построение маршрутов из Redis
+        """
+
+        routes = RepoRoutes()
+        for chat_id, filters in storage.get_filters_for_repo(repo_url).items():
+            routes.add_chat(chat_id, filters)
+        return routes
+
+    def _on_subscription_change(self, action: str, repo_url: str = None):
+        """
+        Уведомление об изменении подписок или фильтров
+        """
+
+        self.invalidate(repo_url)
+
+
+routing_index = RoutingIndex()
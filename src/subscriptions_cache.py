@@ -0,0 +1,139 @@
+import asyncio
+import logging
+
+import redis
+
+from config import Config
+from payload import loads
+from redis_storage import storage, SUBSCRIPTION_CHANGES_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+
+class SubscribedRepos:
+    """
+    Множество URL репозиториев с подписчиками в памяти процесса.
+    Загружается при старте, обновляется через Redis pub/sub и периодически сверяется с Redis
+    """
+
+    def __init__(self, resync_interval: int = 300):
+        self.resync_interval = resync_interval
+        self.repos = set()
+        self.loaded = False
+        self.listeners = []  # callback(action, repo_url) - вызывается из потока pub/sub
+        self.pubsub = None
+        self.listener_thread = None
+        self.resync_task = None
+
+    def __contains__(self, repo_url: str) -> bool:
+        # до загрузки ничего не отбрасываем
+        return not self.loaded or repo_url in self.repos
+
+    def add_listener(self, callback):
+        """
+        Подписаться на изменения подписок и фильтров.
+        При полной перезагрузке вызывается с action="resync" и repo_url=None
+        """
+
+        self.listeners.append(callback)
+
+    def load(self):
+        """
+        Полная загрузка множества из Redis
+        """
+
+        self.repos = storage.get_subscribed_repos()
+        self.loaded = True
+        self._notify("resync")
+        logger.info(f"Loaded {len(self.repos)} subscribed repositories")
+
+    async def start(self):
+        """
+        Загрузка множества и подписка на изменения
+        """
+
+        self.pubsub = storage.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(**{SUBSCRIPTION_CHANGES_CHANNEL: self._handle_message})
+        self.listener_thread = self.pubsub.run_in_thread(
+            sleep_time=1,
+            daemon=True,
+            exception_handler=self._handle_listener_error
+        )
+
+        # загружаем после подписки, чтобы не пропустить изменения между ними
+        await asyncio.to_thread(self.load)
+        self.resync_task = asyncio.create_task(self._resync_loop())
+
+    async def stop(self):
+        """
+        Остановка подписки на изменения
+        """
+
+        if self.resync_task:
+            self.resync_task.cancel()
+            self.resync_task = None
+        if self.listener_thread:
+            # поток закрывает pubsub сам, выйдя из цикла чтения
+            self.listener_thread.stop()
+            await asyncio.to_thread(self.listener_thread.join, 5)
+            self.listener_thread = None
+        elif self.pubsub:
+            self.pubsub.close()
+        self.pubsub = None
+
+    def _handle_message(self, message: dict):
+        """
+        Обработка уведомления об изменении подписок (вызывается в потоке pub/sub)
+        """
+
+        try:
+            change = loads(message["data"])
+            action = change.get("action")
+            repo_url = change.get("repo_url")
+        except Exception as e:
+            logger.warning(f"Invalid subscription change message: {e}")
+            return
+
+        if action == "add":
+            self.repos.add(repo_url)
+        elif action == "remove":
+            # у репозитория могли остаться другие подписчики
+            if not storage.get_chats_for_repo(repo_url):
+                self.repos.discard(repo_url)
+
+        self._notify(action, repo_url)
+
+    def _notify(self, action: str, repo_url: str = None):
+        """
+        Оповестить слушателей об изменении
+        """
+
+        for callback in self.listeners:
+            try:
+                callback(action, repo_url)
+            except Exception as e:
+                logger.error(f"Subscription change listener failed: {e}", exc_info=True)
+
+    def _handle_listener_error(self, error, pubsub, thread):
+        """
+        Ошибка соединения pub/sub: PubSub переподключится при следующем чтении
+        """
+
+        logger.warning(f"Subscription changes listener error: {error}")
+        # пропущенные сообщения восстановит периодическая сверка
+        self.loaded = False
+
+    async def _resync_loop(self):
+        """
+        Периодическая сверка с Redis на случай потерянных сообщений
+        """
+
+        while True:
+            await asyncio.sleep(self.resync_interval if self.loaded else 5)
+            try:
+                await asyncio.to_thread(self.load)
+            except redis.RedisError as e:
+                logger.warning(f"Failed to resync subscribed repositories: {e}")
+
+
+subscribed_repos = SubscribedRepos(resync_interval=Config.SUBSCRIBED_REPOS_RESYNC_INTERVAL)
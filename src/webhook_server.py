@@ -2,36 +2,103 @@ import hmac
 import hashlib
 import logging
 import asyncio
+import time
+from functools import partial
+from typing import Optional
 from aiohttp import web
 
 
 from config import Config
+from coalescing import coalescer, is_terminal_update
+from deduplication import DeliveryDeduplicator
+from delivery import dispatcher, event_messages, fan_out
+from enrichment import enrich_pr_commits
+from filters import extract_attributes
+from grouping import group_buffer
+from event_queue import EventQueue, RedisStreamQueue
+from metrics import (
+    STAGE_DURATION,
+    EVENTS_TOTAL,
+    FILTERED_TOTAL,
+    IN_FLIGHT,
+    FANOUT_SIZE,
+    render_metrics
+)
+from payload import loads, extract_event_info
+from quotas import quota_limiter
 from redis_storage import storage
+from routing import Resolution, routing_index
+from subscriptions_cache import subscribed_repos
 from event_handlers import (
     get_event_handler,
     get_author_from_event,
+    get_event_key,
     get_event_type_for_filter
 )
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# размер части при чтении тела и порция хэширования в потоке
+BODY_CHUNK_SIZE = 64 * 1024
+HASH_BATCH_SIZE = 1024 * 1024
+
 
-def verify_signature(payload: bytes, signature: str) -> bool:
+class PayloadTooLarge(Exception):
     """
-    Проверка подписи вебхука
+    Тело запроса превышает WEBHOOK_MAX_BODY_SIZE
     """
 
-    if not signature:
-        return False
 
-    expected = "sha256=" + hmac.new(
-        Config.WEBHOOK_SECRET.encode(),
-        payload,
-        hashlib.sha256
-    ).hexdigest()
+async def read_signed_body(request: web.Request) -> tuple[bytes, Optional[str]]:
+    """
+    Чтение тела по частям с одновременным вычислением HMAC.
+    Возвращает тело и подпись "sha256=..." (None, если секрет не задан).
+    Для больших тел хэширование выполняется в потоке (hashlib отпускает GIL)
+    """
 
-    return hmac.compare_digest(expected, signature)
+    max_size = Config.WEBHOOK_MAX_BODY_SIZE
+    mac = hmac.new(Config.WEBHOOK_SECRET.encode(), digestmod=hashlib.sha256) if Config.WEBHOOK_SECRET else None
+    offload = (request.content_length or 0) >= Config.WEBHOOK_HASH_THREAD_THRESHOLD
+
+    chunks = []
+    pending = []  # ещё не захэшированные части (для хэширования в потоке)
+    pending_size = 0
+    size = 0
+    hash_time = 0.0
+
+    async for chunk in request.content.iter_chunked(BODY_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            raise PayloadTooLarge()
+        chunks.append(chunk)
+
+        if mac is None:
+            continue
+        if not offload:
+            start = time.perf_counter()
+            mac.update(chunk)
+            hash_time += time.perf_counter() - start
+            continue
+
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= HASH_BATCH_SIZE:
+            start = time.perf_counter()
+            await asyncio.to_thread(mac.update, b"".join(pending))
+            hash_time += time.perf_counter() - start
+            pending, pending_size = [], 0
+
+    if mac is None:
+        return b"".join(chunks), None
+
+    start = time.perf_counter()
+    if pending:
+        await asyncio.to_thread(mac.update, b"".join(pending))
+    digest = "sha256=" + mac.hexdigest()
+    STAGE_DURATION.observe(hash_time + time.perf_counter() - start, "signature")
+
+    return b"".join(chunks), digest
 
 
 async def handle_github_webhook(request: web.Request) -> web.Response:
@@ -50,59 +117,87 @@ async def handle_github_webhook(request: web.Request) -> web.Response:
     if not event_type:
         return web.Response(status=400, text="Missing event type")
 
-    # получение тела запроса
+    # отказ до чтения тела: без подписи или заведомо слишком большое
+    if Config.WEBHOOK_SECRET and not signature:
+        logger.warning(f"Missing signature for delivery {delivery_id}")
+        return web.Response(status=401, text="Invalid signature")
+
+    if request.content_length is not None and request.content_length > Config.WEBHOOK_MAX_BODY_SIZE:
+        logger.warning(f"Payload too large ({request.content_length} bytes) for delivery {delivery_id}")
+        return web.Response(status=413, text="Payload too large")
+
+    # получение тела запроса с вычислением подписи по частям
     try:
-        payload_bytes = await request.read()
-        payload = await request.json()
-    except Exception as e:
-        logger.error(f"Failed to parse payload: {e}")
-        return web.Response(status=400, text="Invalid payload")
+        payload_bytes, expected_signature = await read_signed_body(request)
+    except PayloadTooLarge:
+        logger.warning(f"Payload too large for delivery {delivery_id}")
+        return web.Response(status=413, text="Payload too large")
 
-    # проверка подписи
-    if Config.WEBHOOK_SECRET and not verify_signature(payload_bytes, signature):
+    # проверка подписи (до разбора JSON)
+    if expected_signature and not hmac.compare_digest(expected_signature, signature):
         logger.warning(f"Invalid signature for delivery {delivery_id}")
         return web.Response(status=401, text="Invalid signature")
 
+    # однократный разбор тела
+    try:
+        payload = loads(payload_bytes)
+        event_info = extract_event_info(payload)
+    except Exception as e:
+        logger.error(f"Failed to parse payload: {e}")
+        return web.Response(status=400, text="Invalid payload")
+
+    EVENTS_TOTAL.inc(event_type)
     logger.info(f"Received event: {event_type}, delivery: {delivery_id}")
-    logger.info(f"Payload preview: repository={payload.get('repository', {}).get('full_name')}, action={payload.get('action')}")
+    logger.info(f"Payload preview: repository={event_info.repo_url}, action={event_info.action}, "
+                f"sender={event_info.sender}")
 
     # ping
     if event_type == "ping":
         logger.info("Received ping event - webhook is configured correctly!")
         return web.Response(text="pong")
 
-    # Обогащение PR коммитами
-    if event_type == "pull_request" and payload.get("action") in ["opened", "synchronize"]:
-        try:
-            from github_api import github_api
-            pr = payload.get("pull_request", {})
-            pr_number = pr.get("number")
-            repo = payload.get("repository", {})
-            full_name = repo.get("full_name", "")
-
-            if pr_number and full_name and "/" in full_name:
-                owner, repo_name = full_name.split("/", 1)
-                commits = github_api.get_pr_commits(owner, repo_name, pr_number)
-                if commits:
-                    payload["pull_request"]["commits_list"] = commits
-                    logger.info(f"Enriched PR #{pr_number} with {len(commits)} commits")
-        except Exception as e:
-            logger.warning(f"Failed to enrich PR with commits: {e}")
+    # события репозиториев без подписчиков (оставшиеся после отписки вебхуки)
+    if event_info.repo_url and event_info.repo_url not in subscribed_repos:
+        logger.info(f"No subscribers for {event_info.repo_url}, delivery {delivery_id} skipped")
+        return web.Response(text="No subscribers")
+
+    # повторная доставка (redelivery, ретраи GitHub или балансировщика)
+    deduplicator = request.app['deduplicator']
+    if deduplicator.is_duplicate(delivery_id):
+        logger.info(f"Duplicate delivery {delivery_id} skipped")
+        return web.Response(text="Duplicate delivery")
+
+    # фоновая обработка: подтверждаем доставку сразу
+    event_queue = request.app.get('event_queue')
+    if event_queue:
+        if not event_queue.put(event_type, payload, delivery_id, raw=payload_bytes):
+            logger.warning(f"Failed to enqueue delivery {delivery_id}")
+            deduplicator.forget(delivery_id)
+            return web.Response(status=503, text="Queue unavailable")
+        return web.Response(status=202, text="Accepted")
+
+    try:
+        await process_github_event(event_type, payload, delivery_id, send_notification_func)
+    except Exception:
+        deduplicator.forget(delivery_id)
+        return web.Response(status=500, text="Processing error")
+
+    return web.Response(text="OK")
+
+
+async def process_github_event(event_type: str, payload: dict, delivery_id: str = None,
+                               send_notification_func=None, ack=None) -> bool:
+    """
+    Обработка события: выбор получателей, обогащение, форматирование и рассылка по чатам.
+    Возвращает True, если обновление отложено склейкой: тогда ack (корутинная функция
+    без аргументов) будет вызвана после его отправки или замены более новым
+    """
 
     # получение обработчика события
     handler = get_event_handler(event_type)
     if not handler:
         logger.info(f"No handler for event type: {event_type}")
-        return web.Response(text="OK")
-
-    # формат сообщений
-    try:
-        text, event_key = handler(payload)
-        if not text:
-            return web.Response(text="OK")
-    except Exception as e:
-        logger.error(f"Error formatting event: {e}")
-        return web.Response(status=500, text="Formatting error")
+        return
 
     # получение URL репозитория
     repo = payload.get("repository", {})
@@ -110,7 +205,7 @@ async def handle_github_webhook(request: web.Request) -> web.Response:
 
     if not repo_url:
         logger.warning("No repository URL in payload")
-        return web.Response(text="OK")
+        return
     repo_url = repo_url.rstrip("/")
     logger.info(f"Processing event for repository: {repo_url}")
 
@@ -118,50 +213,131 @@ async def handle_github_webhook(request: web.Request) -> web.Response:
     author = get_author_from_event(event_type, payload)
     filter_event_type = get_event_type_for_filter(event_type)
 
-    # получение чатов, подписанных на этот репозиторий
-    chat_ids = storage.get_chats_for_repo(repo_url)
-    logger.info(f"Found {len(chat_ids)} subscribed chats for {repo_url}")
-
-    if not chat_ids:
-        logger.warning(f"No subscribed chats for repository {repo_url}")
-        return web.Response(text="OK")
-
-    for chat_id in chat_ids:
-        # фильтры для этого чата
-        filters = storage.get_filters(chat_id, repo_url)
-
-        if filters:
-            # проверка, включён ли тип события (только если event_types не пустой)
-            event_types = filters.get("event_types", [])
-            if event_types and filter_event_type not in event_types:
-                logger.info(f"Event type {filter_event_type} filtered out for chat {chat_id}")
-                continue
-
-            # проверка исключения автора
-            excluded_authors = filters.get("excluded_authors", [])
-            if author and author in excluded_authors:
-                logger.info(f"Author {author} filtered out for chat {chat_id}")
-                continue
-
-        # отправка уведомлений
-        logger.info(f"Sending notification to chat {chat_id}")
-        if send_notification_func:
-            try:
-                # необходимость редактирования сообщения
-                edit_existing = event_type in ["workflow_run", "pull_request"]
-                await send_notification_func(
-                    chat_id=chat_id,
-                    text=text,
-                    event_key=event_key,
-                    edit_existing=edit_existing
-                )
-                logger.info(f"✅ Notification sent successfully to chat {chat_id}")
-            except Exception as e:
-                logger.error(f"❌ Failed to send notification to {chat_id}: {e}", exc_info=True)
-        else:
-            logger.error("❌ send_notification_func is not set!")
+    # получатели по индексу маршрутизации
+    with STAGE_DURATION.time("redis_lookup"):
+        attrs = extract_attributes(event_type, payload)
+        route = routing_index.resolve(repo_url, filter_event_type, author, attrs)
+    recipients = route.recipients
+    logger.info(f"Found {len(recipients)} recipients for {repo_url} "
+                f"(filtered: {route.dropped_by_type} by event type, {route.dropped_by_author} by author, "
+                f"{route.dropped_by_rule} by rules)")
+
+    if route.dropped_by_type:
+        FILTERED_TOTAL.inc("event_type", amount=route.dropped_by_type)
+    if route.dropped_by_author:
+        FILTERED_TOTAL.inc("excluded_author", amount=route.dropped_by_author)
+    if route.dropped_by_rule:
+        FILTERED_TOTAL.inc("rules", amount=route.dropped_by_rule)
+
+    # обогащение и форматирование только если есть получатели
+    if not recipients:
+        FANOUT_SIZE.set(0)
+        return
+
+    # частые обновления одного workflow/PR склеиваются: форматируется только последнее
+    event_key = get_event_key(event_type, payload)
+    deliver = partial(
+        deliver_github_event,
+        event_type,
+        payload,
+        handler,
+        recipients,
+        send_notification_func,
+        repo_url=repo_url,
+        route=route,
+        event_key=event_key,
+        author=author,
+        description=f"{event_type} delivery {delivery_id} for {repo_url}"
+    )
+    if event_key:
+        return await coalescer.submit(event_key, deliver, terminal=is_terminal_update(event_type, payload),
+                                      on_done=ack)
+    await deliver()
+    return False
+
+
+async def deliver_github_event(event_type: str, payload: dict, handler, recipients: set,
+                               send_notification_func=None, repo_url: str = "", route: Resolution = None,
+                               event_key: str = None, author: str = None, description: str = ""):
+    """
+    Квоты, обогащение, форматирование и рассылка события выбранным получателям.
+    Выполняется после склейки обновлений, поэтому склеенные обновления квоту не расходуют.
+    Чатам с группировкой событие не отправляется, а попадает в буфер группировки
+    """
 
-    return web.Response(text="OK")
+    filtered = 0
+    grouped = set()
+    if route:
+        filtered = route.dropped_by_type + route.dropped_by_author + route.dropped_by_rule
+        # квоты шумных репозиториев: события сверх квоты уходят в сводку
+        if route.quotas:
+            recipients, dropped_by_quota = await quota_limiter.apply(
+                repo_url, recipients, route.quotas, get_event_type_for_filter(event_type),
+                author, event_key=event_key
+            )
+            filtered += dropped_by_quota
+        grouped = route.grouped & recipients
+
+    FANOUT_SIZE.set(len(recipients))
+    if not recipients:
+        return
+
+    # Обогащение PR коммитами
+    if event_type == "pull_request" and payload.get("action") in ["opened", "synchronize"]:
+        with STAGE_DURATION.time("enrichment"):
+            await enrich_pr_commits(payload)
+
+    # формат сообщений
+    try:
+        with STAGE_DURATION.time("formatting"):
+            text, event_key = handler(payload)
+        if not text:
+            return
+    except Exception as e:
+        logger.error(f"Error formatting event: {e}")
+        raise
+
+    if grouped:
+        await group_buffer.add(repo_url, grouped, text)
+        recipients = recipients - grouped
+        if not recipients:
+            return
+
+    # рассылка только ставится в очереди чатов: лимиты Telegram не задерживают обработку события
+    await fan_out(
+        send_notification_func,
+        recipients,
+        text,
+        event_key=event_key,
+        # необходимость редактирования сообщения
+        edit_existing=event_type in ["workflow_run", "pull_request"],
+        filtered=filtered,
+        description=description
+    )
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """
+    Метрики в формате Prometheus
+    """
+
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+@web.middleware
+async def in_flight_middleware(request: web.Request, handler):
+    """
+    Учёт запросов вебхуков в обработке
+    """
+
+    if request.path != "/webhook/github":
+        return await handler(request)
+
+    IN_FLIGHT.inc()
+    try:
+        return await handler(request)
+    finally:
+        IN_FLIGHT.dec()
 
 
 async def health_check(request: web.Request) -> web.Response:
@@ -172,31 +348,180 @@ async def health_check(request: web.Request) -> web.Response:
     return web.Response(text="OK")
 
 
+def create_event_queue(notification_func=None, workers: int = None):
+    """
+    Создание очереди событий согласно Config.WEBHOOK_PROCESSING
+    """
+
+    async def process_func(event_type, payload, delivery_id, ack=None):
+        return await process_github_event(event_type, payload, delivery_id, notification_func, ack)
+
+    if workers is None:
+        workers = Config.WEBHOOK_WORKERS
+
+    if Config.WEBHOOK_PROCESSING == "queue":
+        return EventQueue(
+            process_func,
+            maxsize=Config.WEBHOOK_QUEUE_SIZE,
+            workers=workers
+        )
+    if Config.WEBHOOK_PROCESSING == "stream":
+        return RedisStreamQueue(
+            process_func,
+            storage.client,
+            stream=Config.REDIS_STREAM_KEY,
+            group=Config.REDIS_STREAM_GROUP,
+            workers=workers,
+            maxlen=Config.REDIS_STREAM_MAXLEN,
+            claim_idle_ms=Config.REDIS_STREAM_CLAIM_IDLE_MS
+        )
+    return None
+
+
+async def start_subscribed_repos(app: web.Application):
+    """
+    Загрузка множества репозиториев с подписчиками
+    """
+
+    await subscribed_repos.start()
+
+
+async def stop_subscribed_repos(app: web.Application):
+    """
+    Остановка отслеживания подписок
+    """
+
+    await subscribed_repos.stop()
+
+
+async def start_dispatcher(app: web.Application):
+    """
+    Запуск упорядоченных очередей доставки по чатам
+    """
+
+    await dispatcher.start()
+
+
+async def stop_dispatcher(app: web.Application):
+    """
+    Остановка очередей доставки (после очереди событий)
+    """
+
+    await dispatcher.stop()
+    await event_messages.flush()
+
+
+async def start_quota_flusher(app: web.Application):
+    """
+    Запуск периодической отправки сводок событий сверх квоты
+    """
+
+    await quota_limiter.start(app['notification_func'])
+
+
+async def stop_quota_flusher(app: web.Application):
+    """
+    Остановка отправки сводок
+    """
+
+    await quota_limiter.stop()
+
+
+async def start_group_flusher(app: web.Application):
+    """
+    Запуск периодической отправки сгруппированных событий
+    """
+
+    await group_buffer.start(app['notification_func'])
+
+
+async def stop_group_flusher(app: web.Application):
+    """
+    Остановка отправки сгруппированных событий
+    """
+
+    await group_buffer.stop()
+
+
+async def stop_coalescer(app: web.Application):
+    """
+    Отправка отложенных обновлений событий
+    """
+
+    await coalescer.stop()
+
+
+async def start_event_queue(app: web.Application):
+    """
+    Запуск воркеров очереди событий
+    """
+
+    await app['event_queue'].start()
+
+
+async def stop_event_queue(app: web.Application):
+    """
+    Остановка воркеров очереди событий
+    """
+
+    await app['event_queue'].stop()
+
+
 def create_app(notification_func=None) -> web.Application:
     """
     Создание веб-приложения
     """
 
-    app = web.Application()
+    app = web.Application(
+        middlewares=[in_flight_middleware],
+        client_max_size=Config.WEBHOOK_MAX_BODY_SIZE
+    )
 
     # сохраняем функцию в app state
     if notification_func:
         app['notification_func'] = notification_func
+        app.on_startup.append(start_quota_flusher)
+        app.on_cleanup.append(stop_quota_flusher)
+        app.on_startup.append(start_group_flusher)
+        app.on_cleanup.append(stop_group_flusher)
+
+    app.on_startup.append(start_subscribed_repos)
+    app.on_cleanup.append(stop_subscribed_repos)
+    app.on_startup.append(start_dispatcher)
+
+    app['deduplicator'] = DeliveryDeduplicator(
+        ttl=Config.DELIVERY_DEDUP_TTL,
+        lru_size=Config.DELIVERY_DEDUP_LRU_SIZE
+    )
+
+    # фоновая обработка событий пулом воркеров
+    event_queue = create_event_queue(notification_func)
+    if event_queue:
+        app['event_queue'] = event_queue
+        app.on_startup.append(start_event_queue)
+        app.on_cleanup.append(stop_event_queue)
+
+    # отложенные обновления отправляются до остановки очередей доставки
+    app.on_cleanup.append(stop_coalescer)
+    # очереди доставки останавливаются после воркеров, которые в них пишут
+    app.on_cleanup.append(stop_dispatcher)
 
     app.router.add_post("/webhook/github", handle_github_webhook)
     app.router.add_get("/health", health_check)
+    app.router.add_get("/metrics", metrics_handler)
     return app
 
 
-async def start_webhook_server(notification_func=None):
+async def start_webhook_server(notification_func=None, reuse_port: bool = False):
     """
-    Запуск webhook сервера
+    Запуск webhook сервера.
+    reuse_port - несколько процессов слушают один порт (SO_REUSEPORT)
     """
 
     app = create_app(notification_func)
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", Config.WEBHOOK_PORT)
+    site = web.TCPSite(runner, "0.0.0.0", Config.WEBHOOK_PORT, reuse_port=reuse_port or None)
     await site.start()
     logger.info(f"Webhook server started on port {Config.WEBHOOK_PORT}")
     return runner
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# модули бота импортируют друг друга из src/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
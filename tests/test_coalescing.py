@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+import redis
+
+import coalescing
+from coalescing import EventCoalescer, is_terminal_update
+
+
+class FakeUpdateCounter:
+    """
+    Номера обновлений событий в памяти вместо Redis
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.fail = False
+
+    def count_event_update(self, event_key, ttl):
+        if self.fail:
+            raise redis.ConnectionError("down")
+        self.counts[event_key] = self.counts.get(event_key, 0) + 1
+        return self.counts[event_key]
+
+    def get_event_update_count(self, event_key):
+        if self.fail:
+            raise redis.ConnectionError("down")
+        return self.counts.get(event_key, 0)
+
+
+@pytest.fixture
+def counter(monkeypatch):
+    counter = FakeUpdateCounter()
+    monkeypatch.setattr(coalescing, "storage", counter)
+    return counter
+
+
+def recorder(sent: list, state: str):
+    async def deliver():
+        sent.append(state)
+    return deliver
+
+
+def test_is_terminal_update():
+    assert is_terminal_update("workflow_run", {"action": "completed"})
+    assert not is_terminal_update("workflow_run", {"action": "in_progress"})
+    assert is_terminal_update("pull_request", {"action": "closed"})
+    assert not is_terminal_update("push", {"action": "completed"})
+
+
+def test_only_latest_state_is_sent(counter):
+    sent = []
+
+    async def run():
+        coalescer = EventCoalescer(window=0.05)
+        for state in ("requested", "queued", "in_progress"):
+            await coalescer.submit("wf:1", recorder(sent, state))
+        assert sent == []
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert sent == ["in_progress"]
+
+
+def test_terminal_update_is_sent_at_once_and_drops_pending(counter):
+    sent = []
+
+    async def run():
+        coalescer = EventCoalescer(window=0.05)
+        await coalescer.submit("wf:1", recorder(sent, "in_progress"))
+        await coalescer.submit("wf:1", recorder(sent, "completed"), terminal=True)
+        assert sent == ["completed"]
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert sent == ["completed"]
+
+
+def test_update_superseded_in_another_process_is_dropped(counter):
+    sent = []
+
+    async def run():
+        first, second = EventCoalescer(window=0.05), EventCoalescer(window=0.05)
+        await first.submit("wf:1", recorder(sent, "in_progress"))
+        await second.submit("wf:1", recorder(sent, "completed"), terminal=True)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert sent == ["completed"]
+
+
+def test_events_are_coalesced_independently(counter):
+    sent = []
+
+    async def run():
+        coalescer = EventCoalescer(window=0.05)
+        await coalescer.submit("wf:1", recorder(sent, "wf1"))
+        await coalescer.submit("pr:2", recorder(sent, "pr2"))
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert sorted(sent) == ["pr2", "wf1"]
+
+
+def test_stop_flushes_pending_updates(counter):
+    sent = []
+
+    async def run():
+        coalescer = EventCoalescer(window=10)
+        await coalescer.submit("wf:1", recorder(sent, "in_progress"))
+        await coalescer.stop()
+        assert not coalescer.timers
+
+    asyncio.run(run())
+    assert sent == ["in_progress"]
+
+
+def test_zero_window_disables_coalescing(counter):
+    sent = []
+
+    async def run():
+        coalescer = EventCoalescer(window=0)
+        await coalescer.submit("wf:1", recorder(sent, "queued"))
+        await coalescer.submit("wf:1", recorder(sent, "in_progress"))
+
+    asyncio.run(run())
+    assert sent == ["queued", "in_progress"]
+    assert counter.counts == {}
+
+
+def test_redis_errors_do_not_block_delivery(counter):
+    sent = []
+    counter.fail = True
+
+    async def run():
+        coalescer = EventCoalescer(window=0.05)
+        await coalescer.submit("wf:1", recorder(sent, "in_progress"))
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert sent == ["in_progress"]
+
+
+def test_held_update_is_acked_only_after_delivery(counter):
+    sent = []
+    acked = []
+
+    def ack(state: str):
+        async def on_done():
+            # подтверждение приходит после отправки своего состояния
+            acked.append((state, list(sent)))
+        return on_done
+
+    async def run():
+        coalescer = EventCoalescer(window=0.05)
+        held = [
+            await coalescer.submit("wf:1", recorder(sent, state), on_done=ack(state))
+            for state in ("queued", "in_progress")
+        ]
+        # заменённое обновление подтверждается сразу, последнее ждёт отправки
+        assert acked == [("queued", [])]
+        await asyncio.sleep(0.1)
+        terminal = await coalescer.submit("wf:1", recorder(sent, "completed"), terminal=True,
+                                          on_done=ack("completed"))
+        return held, terminal
+
+    held, terminal = asyncio.run(run())
+    assert held == [True, True]
+    assert terminal is False
+    assert acked == [("queued", []), ("in_progress", ["in_progress"])]
+    assert sent == ["in_progress", "completed"]
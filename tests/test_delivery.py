@@ -0,0 +1,269 @@
+import asyncio
+import time
+
+import pytest
+
+import delivery
+from delivery import PartitionedDispatcher, TokenBucket
+
+
+class FakeDeadLetters:
+    """
+    Dead-letter очередь в памяти вместо Redis
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def push_dead_letter(self, entry, maxlen):
+        self.entries.append(entry)
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"retry after {retry_after}")
+        self.retry_after = retry_after
+
+
+@pytest.fixture
+def dead_letters(monkeypatch):
+    dead_letters = FakeDeadLetters()
+    monkeypatch.setattr(delivery, "storage", dead_letters)
+    return dead_letters
+
+
+def make_dispatcher(**kwargs) -> PartitionedDispatcher:
+    options = dict(partitions=2, global_rate=1000, private_rate=1000, group_rate=1000,
+                   retry_base_delay=0.01, retry_max_delay=0.02, shared_limits=False)
+    options.update(kwargs)
+    return PartitionedDispatcher(**options)
+
+
+async def run_dispatcher(dispatcher: PartitionedDispatcher, jobs: list) -> list:
+    """
+    Поставить (chat_id, func[, dead_letter]) в очередь и дождаться результатов
+    """
+
+    await dispatcher.start()
+    try:
+        futures = [await dispatcher.submit(*job) for job in jobs]
+        return await asyncio.gather(*futures, return_exceptions=True)
+    finally:
+        await dispatcher.stop()
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(rate=100, capacity=2)
+
+    assert bucket.delay() == 0
+    bucket.consume()
+    bucket.consume()
+    assert 0 < bucket.delay() <= 0.01
+    assert not bucket.is_full()
+
+    time.sleep(0.03)
+    assert bucket.delay() == 0
+    assert bucket.is_full()
+
+
+def test_token_bucket_does_not_exceed_capacity():
+    bucket = TokenBucket(rate=100, capacity=1)
+    # без ограничения за это время накопилось бы 5 токенов
+    time.sleep(0.05)
+
+    assert bucket.delay() == 0
+    bucket.consume()
+    assert bucket.delay() > 0
+
+
+def test_messages_of_one_chat_keep_order(dead_letters):
+    sent = []
+
+    def job(chat_id, n):
+        async def send():
+            # более поздние сообщения отправляются быстрее - порядок держит очередь чата
+            await asyncio.sleep(0.01 / (n + 1))
+            sent.append((chat_id, n))
+            return n
+        return chat_id, send
+
+    jobs = [job(chat_id, n) for n in range(5) for chat_id in (1, 2, 3)]
+    results = asyncio.run(run_dispatcher(make_dispatcher(), jobs))
+
+    assert results == [n for n in range(5) for _ in (1, 2, 3)]
+    for chat_id in (1, 2, 3):
+        assert [n for c, n in sent if c == chat_id] == list(range(5))
+
+
+def test_chat_without_tokens_does_not_block_partition(dead_letters):
+    sent = []
+
+    def job(chat_id):
+        async def send():
+            sent.append((chat_id, time.monotonic()))
+        return chat_id, send
+
+    # одна партиция: медленный личный чат и группа с запасом токенов
+    dispatcher = make_dispatcher(partitions=1, private_rate=10)
+    start = time.monotonic()
+    asyncio.run(run_dispatcher(dispatcher, [job(1), job(1), job(1), job(-1), job(-1)]))
+
+    group_done = max(t for c, t in sent if c == -1) - start
+    private_done = max(t for c, t in sent if c == 1) - start
+    assert group_done < 0.05
+    assert private_done >= 0.15
+
+
+def test_retry_after_parks_chat_and_repeats_message(dead_letters):
+    calls = []
+
+    async def send():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RetryAfter(0.05)
+        return "ok"
+
+    results = asyncio.run(run_dispatcher(make_dispatcher(), [(1, send)]))
+
+    assert results == ["ok"]
+    assert calls[1] - calls[0] >= 0.05
+    assert not dead_letters.entries
+
+
+def test_transient_error_is_retried(dead_letters):
+    calls = []
+
+    async def send():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+
+    results = asyncio.run(run_dispatcher(make_dispatcher(max_retries=5), [(1, send)]))
+
+    assert results == ["ok"]
+    assert len(calls) == 3
+    assert not dead_letters.entries
+
+
+def test_exhausted_retries_go_to_dead_letter_queue(dead_letters):
+    calls = []
+
+    async def send():
+        calls.append(1)
+        raise ConnectionError("reset")
+
+    async def after():
+        return "next"
+
+    jobs = [(1, send, {"text": "hello"}), (1, after)]
+    results = asyncio.run(run_dispatcher(make_dispatcher(max_retries=2), jobs))
+
+    assert isinstance(results[0], ConnectionError)
+    # следующее сообщение чата не теряется
+    assert results[1] == "next"
+    assert len(calls) == 3
+    assert len(dead_letters.entries) == 1
+    entry = dead_letters.entries[0]
+    assert entry["chat_id"] == 1
+    assert entry["text"] == "hello"
+    assert entry["attempts"] == 3
+
+
+def test_permanent_error_is_not_retried(dead_letters):
+    calls = []
+
+    async def send():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    results = asyncio.run(run_dispatcher(make_dispatcher(), [(1, send, {"text": "hello"})]))
+
+    assert isinstance(results[0], ValueError)
+    assert len(calls) == 1
+    assert not dead_letters.entries
+
+
+def test_skipped_job_takes_no_tokens(dead_letters):
+    sent = []
+
+    async def send():
+        sent.append(1)
+        return "sent"
+
+    async def run():
+        # два токена в секунду: пропущенные сообщения не должны их тратить
+        dispatcher = make_dispatcher(private_rate=2)
+        await dispatcher.start()
+        try:
+            first = await dispatcher.submit(1, send)
+            skipped = [await dispatcher.submit(1, send, None, lambda: "unchanged") for _ in range(3)]
+            last = await dispatcher.submit(1, send, None, lambda: None)
+            return await asyncio.wait_for(asyncio.gather(first, *skipped, last), 3)
+        finally:
+            await dispatcher.stop()
+
+    start = time.monotonic()
+    results = asyncio.run(run())
+
+    assert results == ["sent", "unchanged", "unchanged", "unchanged", "sent"]
+    assert len(sent) == 2
+    # вторая отправка ждала один токен, а не четыре
+    assert time.monotonic() - start < 1.0
+
+
+def test_idle_buckets_are_evicted(dead_letters, monkeypatch):
+    monkeypatch.setattr(delivery, "BUCKET_SWEEP_INTERVAL", 0)
+
+    async def send():
+        return "ok"
+
+    dispatcher = make_dispatcher()
+    asyncio.run(run_dispatcher(dispatcher, [(chat_id, send) for chat_id in range(1, 51)]))
+    assert len(dispatcher.buckets) <= 50
+
+    time.sleep(0.01)
+    dispatcher._chat_bucket(1000)
+    assert list(dispatcher.buckets) == [1000]
+
+
+def test_fan_out_returns_before_paced_sends(dead_letters, monkeypatch):
+    sent = []
+
+    async def notify(chat_id, **kwargs):
+        sent.append(chat_id)
+        return delivery.DeliveryResult(delivery.SENT, 1)
+
+    async def run():
+        # группа получает одно сообщение в секунду, личный чат не ограничен
+        dispatcher = make_dispatcher(group_rate=1)
+        monkeypatch.setattr(delivery, "dispatcher", dispatcher)
+        await dispatcher.start()
+        try:
+            start = time.monotonic()
+            summaries = [await delivery.fan_out(notify, [-1, 1], f"event {i}") for i in range(5)]
+            queued = time.monotonic() - start
+            await asyncio.sleep(0.1)
+            private = sent.count(1)
+            stats = await asyncio.wait_for(asyncio.gather(*summaries), 5)
+            return queued, private, stats
+        finally:
+            await dispatcher.stop()
+
+    queued, private, stats = asyncio.run(run())
+
+    # постановка не ждёт лимита группы, и личный чат не ждёт группу
+    assert queued < 0.5
+    assert private == 5
+    assert all(item[delivery.SENT] == 2 for item in stats)
+
+
+def test_event_messages_prefer_redis_over_recent():
+    messages = delivery.EventMessages()
+    messages.remember("wf:1", 1, 10, "old")
+
+    # другой процесс уже отредактировал сообщение: его хэш в Redis новее памяти
+    assert messages.lookup("wf:1", 1, {1: (10, "new")}) == (10, "new")
+    # до записи в Redis используется недавняя отправка процесса
+    assert messages.lookup("wf:1", 1, {}) == (10, "old")
+    assert messages.lookup("wf:1", 2, {}) is None
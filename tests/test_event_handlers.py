@@ -0,0 +1,33 @@
+from event_handlers import format_create_event, get_event_handler, get_event_type_for_filter
+from filters import CompiledFilter, extract_attributes
+
+
+def create_payload(ref_type: str, ref: str) -> dict:
+    return {
+        "ref": ref,
+        "ref_type": ref_type,
+        "repository": {"full_name": "octo/repo", "html_url": "https://github.com/octo/repo"},
+        "sender": {"login": "octocat"}
+    }
+
+
+def test_create_webhook_is_formatted_like_create_event():
+    # вебхук приходит как "create", Events API - как "CreateEvent"
+    assert get_event_handler("create") is format_create_event
+    assert get_event_handler("CreateEvent") is format_create_event
+
+    text, event_key = get_event_handler("create")(create_payload("branch", "feature/x"))
+    assert "Создана новая ветка" in text
+    assert "https://github.com/octo/repo/tree/feature/x" in text
+    assert event_key == "create:octo/repo:feature/x"
+
+
+def test_create_webhook_is_filtered_as_push():
+    assert get_event_type_for_filter("create") == "push"
+    assert get_event_type_for_filter("CreateEvent") == "push"
+
+    branches = CompiledFilter({"branches": ["main", "release/*"]})
+    assert branches.matches(extract_attributes("create", create_payload("branch", "release/1.0")))
+    assert not branches.matches(extract_attributes("create", create_payload("branch", "feature/x")))
+    # создание тега не проходит ограничение по веткам
+    assert not branches.matches(extract_attributes("create", create_payload("tag", "v1.0")))
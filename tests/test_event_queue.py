@@ -0,0 +1,27 @@
+import asyncio
+
+import fakeredis
+
+from event_queue import RedisStreamQueue
+
+
+def test_stream_queue_without_workers_only_ingests():
+    client = fakeredis.FakeRedis(decode_responses=True)
+
+    async def process(event_type, payload, delivery_id):
+        raise AssertionError("ingest-only queue must not process events")
+
+    async def run():
+        queue = RedisStreamQueue(process, client, stream="events", group="delivery", workers=0)
+        await queue.start()
+        try:
+            assert queue.put("push", {"ref": "refs/heads/main"}, "delivery-1")
+            await asyncio.sleep(0.05)
+            return queue.executor, queue.workers
+        finally:
+            await queue.stop()
+
+    executor, workers = asyncio.run(run())
+
+    assert executor is None and workers == []
+    assert client.xlen("events") == 1
@@ -0,0 +1,117 @@
+import re
+
+import pytest
+
+from filters import EventAttributes, compile_filter, extract_attributes, glob_to_regex, parse_patterns
+
+
+@pytest.mark.parametrize("pattern, path, expected", [
+    ("main", "main", True),
+    ("main", "mainline", False),
+    ("release/*", "release/1.2", True),
+    ("release/*", "release/1.2/hotfix", False),
+    ("release/**", "release/1.2/hotfix", True),
+    ("services/**/api.py", "services/api.py", True),
+    ("services/**/api.py", "services/a/b/api.py", True),
+    ("services/**/api.py", "services/a/b/api.pyc", False),
+    ("v?", "v1", True),
+    ("v?", "v/", False),
+    ("docs/*.md", "docs/a.b.md", True),
+    ("a+b(c)", "a+b(c)", True),
+])
+def test_glob_to_regex(pattern, path, expected):
+    assert bool(re.fullmatch(glob_to_regex(pattern), path)) is expected
+
+
+def test_compile_filter_without_rules():
+    assert compile_filter(None) is None
+    assert compile_filter({"event_types": ["push"], "branches": [], "quota": 10}) is None
+
+
+def test_branches_rule():
+    compiled = compile_filter({"branches": ["main", "release/*"]})
+
+    assert compiled.matches(EventAttributes(branch="main"))
+    assert compiled.matches(EventAttributes(branch="release/2.0"))
+    assert not compiled.matches(EventAttributes(branch="feature/x"))
+    # у issues нет ветки - правило не применяется
+    assert compiled.matches(EventAttributes())
+
+
+def test_tag_push_does_not_pass_branches_rule():
+    compiled = compile_filter({"branches": ["main", "release/*"]})
+    attrs = extract_attributes("push", {"ref": "refs/tags/v1", "commits": []})
+
+    assert attrs.branch == ""
+    assert not compiled.matches(attrs)
+
+
+def test_tag_create_does_not_pass_branches_rule():
+    compiled = compile_filter({"branches": ["*"]})
+
+    assert not compiled.matches(extract_attributes("create", {"ref_type": "tag", "ref": "v1"}))
+    assert compiled.matches(extract_attributes("create", {"ref_type": "branch", "ref": "dev"}))
+
+
+def test_paths_rule():
+    compiled = compile_filter({"paths": ["services/api/**"]})
+    payload = {
+        "ref": "refs/heads/main",
+        "commits": [
+            {"added": ["README.md"], "modified": [], "removed": []},
+            {"added": [], "modified": ["services/api/app.py"], "removed": []},
+        ]
+    }
+
+    assert compiled.matches(extract_attributes("push", payload))
+    payload["commits"].pop()
+    assert not compiled.matches(extract_attributes("push", payload))
+
+
+def test_webhook_push_without_files_does_not_pass_paths_rule():
+    compiled = compile_filter({"paths": ["services/**"]})
+    # удаление ветки: коммитов нет
+    attrs = extract_attributes("push", {"ref": "refs/heads/old", "deleted": True, "commits": []})
+
+    assert attrs.paths == ()
+    assert not compiled.matches(attrs)
+
+
+def test_events_api_push_skips_paths_rule():
+    compiled = compile_filter({"paths": ["services/**"]})
+    # Events API не передаёт списки файлов
+    attrs = extract_attributes("PushEvent", {"ref": "refs/heads/main", "commits": [{"sha": "1"}]})
+
+    assert attrs.paths is None
+    assert compiled.matches(attrs)
+
+
+def test_labels_rule():
+    compiled = compile_filter({"labels": ["urgent", "bug"]})
+    payload = {"pull_request": {"labels": [{"name": "bug"}], "base": {"ref": "main"}}}
+
+    assert compiled.matches(extract_attributes("pull_request", payload))
+    payload["pull_request"]["labels"] = [{"name": "docs"}]
+    assert not compiled.matches(extract_attributes("pull_request", payload))
+    payload["pull_request"]["labels"] = []
+    assert not compiled.matches(extract_attributes("pull_request", payload))
+
+
+def test_workflow_and_conclusion_rules():
+    compiled = compile_filter({"workflows": ["CI"], "conclusions": ["Failure"]})
+    run = {"name": "CI", "head_branch": "main", "conclusion": "failure"}
+
+    assert compiled.matches(extract_attributes("workflow_run", {"workflow_run": run}))
+    assert not compiled.matches(extract_attributes("workflow_run", {"workflow_run": dict(run, name="Lint")}))
+    # незавершённый запуск не проходит правило результата
+    assert not compiled.matches(extract_attributes("workflow_run", {"workflow_run": dict(run, conclusion=None)}))
+
+
+def test_pull_request_branch_is_base_branch():
+    attrs = extract_attributes("pull_request", {"pull_request": {"base": {"ref": "main"}, "labels": []}})
+
+    assert attrs.branch == "main"
+
+
+def test_parse_patterns():
+    assert parse_patterns("main, release/*\nhotfix/** ,,") == ["main", "release/*", "hotfix/**"]
@@ -0,0 +1,20 @@
+from event_handlers import format_grouped_events
+from grouping import MAX_MESSAGE_LENGTH, GroupBuffer
+
+
+def test_split_counts_header_and_separators():
+    # 20 событий по 200 символов: сами тексты укладываются в лимит, сообщение целиком - нет
+    texts = [f"event {i}: " + "x" * 190 for i in range(20)]
+    assert sum(len(text) for text in texts) <= MAX_MESSAGE_LENGTH
+
+    chunks = GroupBuffer()._split("octo/repo", texts)
+
+    assert len(chunks) > 1
+    assert [text for chunk in chunks for text in chunk] == texts
+    assert all(len(format_grouped_events("octo/repo", chunk)) <= MAX_MESSAGE_LENGTH for chunk in chunks)
+
+
+def test_split_keeps_small_groups_in_one_message():
+    texts = ["push", "issue", "comment"]
+
+    assert GroupBuffer()._split("octo/repo", texts) == [texts]